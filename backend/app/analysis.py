@@ -1,36 +1,32 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, select
 from app import models
 from app.openai_client import openai_client
+from common.tokens import count_tokens
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
 import os
 import json
 import logging
+import threading
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def generate_analysis(project_id: int, db: Session, constraints: dict = None):
-    logger.info(f"Starting analysis for project {project_id}")
-    project = db.query(models.Project).filter(models.Project.id == project_id).first()
-    if not project:
-        logger.error(f"Project NOT found: {project_id}")
-        return None
+ANALYSIS_MODEL = "gpt-4o"
+# Bump whenever SYSTEM_PROMPT, MAP_SYSTEM_PROMPT or the context format changes so
+# cached results produced by the old prompts are no longer reused
+ANALYSIS_PROMPT_VERSION = 1
+# single: one call with all context; map_reduce: per-org map calls then one reduce;
+# auto: map_reduce only when the context would not fit ANALYSIS_SINGLE_PASS_MAX_TOKENS
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "auto").lower()
+ANALYSIS_SINGLE_PASS_MAX_TOKENS = int(os.getenv("ANALYSIS_SINGLE_PASS_MAX_TOKENS", "60000"))
+ANALYSIS_MAP_MODEL = os.getenv("ANALYSIS_MAP_MODEL", "gpt-4o")
+ANALYSIS_MAP_SEGMENT_TOKENS = int(os.getenv("ANALYSIS_MAP_SEGMENT_TOKENS", "40000"))
+ANALYSIS_MAP_CONCURRENCY = int(os.getenv("ANALYSIS_MAP_CONCURRENCY", "4"))
 
-    # Get all chunks for this project
-    orgs = project.organizations
-    all_context = ""
-    evidence_map = {}
-
-    for org in orgs:
-        all_context += f"\n--- ORGANIZATION: {org.name} ({'Base' if org.is_base else 'Competitor'}) ---\n"
-        uploads = db.query(models.Upload).filter(models.Upload.organization_id == org.id).all()
-        for upload in uploads:
-            chunks = db.query(models.ExtractedChunk).filter(models.ExtractedChunk.upload_id == upload.id).all()
-            for chunk in chunks:
-                all_context += f"Source: {upload.filename}, Content: {chunk.content}\n"
-                # Store for citation mapping if needed
-                evidence_map[chunk.id] = {"source": upload.filename, "content": chunk.content}
-
-    system_prompt = """
+SYSTEM_PROMPT = """
     You are a Senior Market Analyst and ML Engineer. 
     Analyze the provided context for a Base Organization and its Competitors.
     Generate a JSON response with the following structure:
@@ -55,25 +51,262 @@ def generate_analysis(project_id: int, db: Session, constraints: dict = None):
     }
     """
 
+MAP_SYSTEM_PROMPT = """
+    You are a Senior Market Analyst. Condense the provided documents about ONE organization
+    into a factual profile used later for a side-by-side competitor comparison.
+    Generate a JSON response with the following structure:
+    {
+      "organization": "Name",
+      "role": "Base or Competitor",
+      "positioning": "Target market and value proposition",
+      "offerings": ["Product or service", "..."],
+      "pricing": "Pricing model and price points",
+      "features": {"Feature Name": "Summary"},
+      "strengths": ["..."],
+      "weaknesses": ["..."],
+      "evidence": ["Short verbatim snippet with its source", "..."]
+    }
+    Only include facts supported by the documents.
+    """
+
+def compute_fingerprint(db: Session, project_id: int, constraints: dict = None) -> str:
+    """Hash everything that determines an analysis result.
+
+    Covers the completed uploads per organization (with their chunk counts, so a
+    re-processed upload counts as changed), the models, the prompt version and the
+    canonicalized constraints. Any upload that finishes, fails or is re-processed
+    yields a new fingerprint, which invalidates the cached result.
+    """
+    Upload = models.Upload
+    rows = db.query(
+        Upload.organization_id, Upload.id, Upload.content_hash, Upload.s3_key, func.count(models.ExtractedChunk.id)
+    ).outerjoin(models.ExtractedChunk, models.ExtractedChunk.upload_id == Upload.id).filter(
+        Upload.project_id == project_id, Upload.status == "completed"
+    ).group_by(Upload.organization_id, Upload.id, Upload.content_hash, Upload.s3_key).order_by(Upload.id).all()
+
+    uploads = {}
+    for org_id, upload_id, content_hash, s3_key, chunk_count in rows:
+        # Older uploads have no content hash; their S3 key still identifies the bytes
+        uploads.setdefault(str(org_id), []).append([upload_id, content_hash or s3_key, chunk_count])
+    orgs = db.query(models.Organization.id, models.Organization.name, models.Organization.is_base).filter(
+        models.Organization.project_id == project_id
+    ).order_by(models.Organization.id).all()
+
+    payload = {
+        "organizations": [[o.id, o.name, o.is_base] for o in orgs],
+        "uploads": uploads,
+        "model": ANALYSIS_MODEL,
+        "map_model": ANALYSIS_MAP_MODEL,
+        "prompt_version": ANALYSIS_PROMPT_VERSION,
+        "constraints": constraints or {},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")).hexdigest()
+
+def find_cached_result(db: Session, project_id: int, fingerprint: str):
+    return db.query(models.AnalysisResult).filter(
+        models.AnalysisResult.project_id == project_id,
+        models.AnalysisResult.fingerprint == fingerprint,
+    ).order_by(models.AnalysisResult.version.desc()).first()
+
+def _next_version(db: Session, project_id: int) -> int:
+    return db.query(models.AnalysisResult).filter(models.AnalysisResult.project_id == project_id).count() + 1
+
+def reuse_cached_result(db: Session, cached):
+    """Serve a cache hit without an LLM call.
+
+    If a newer version (e.g. a refinement with other constraints) has been saved since,
+    the cached JSON is copied into a new version so it becomes the latest result again.
+    """
+    latest = db.query(models.AnalysisResult).filter(
+        models.AnalysisResult.project_id == cached.project_id
+    ).order_by(models.AnalysisResult.version.desc()).first()
+    if latest.id == cached.id:
+        return cached
+    db_result = models.AnalysisResult(
+        project_id=cached.project_id,
+        results_json=cached.results_json,
+        constraints=cached.constraints,
+        fingerprint=cached.fingerprint,
+        version=_next_version(db, cached.project_id)
+    )
+    db.add(db_result)
+    db.commit()
+    db.refresh(db_result)
+    return db_result
+
+# Rows fetched per round trip while streaming a project's chunks
+ANALYSIS_CONTEXT_FETCH_SIZE = int(os.getenv("ANALYSIS_CONTEXT_FETCH_SIZE", "500"))
+
+OrgInfo = namedtuple("OrgInfo", ["id", "name", "is_base"])
+
+def org_header(org) -> str:
+    return f"\n--- ORGANIZATION: {org.name} ({'Base' if org.is_base else 'Competitor'}) ---\n"
+
+def iter_context_rows(db: Session, project_id: int):
+    """Stream (OrgInfo, line) for every chunk of the project's completed uploads with a single query, skipping near-duplicates.
+
+    Rows come ordered by organization, upload and chunk, fetched ANALYSIS_CONTEXT_FETCH_SIZE
+    at a time, so the corpus is never fully loaded. Organizations without chunks yield
+    one (OrgInfo, None) row so they still appear in the prompt.
+    """
+    Org, Upload, Chunk = models.Organization, models.Upload, models.ExtractedChunk
+    query = (
+        select(Org.id, Org.name, Org.is_base, Upload.filename, Chunk.content)
+        .select_from(Org)
+        # Only completed uploads, the same set compute_fingerprint hashes, so a cached
+        # result always matches the chunks it was built from
+        .outerjoin(Upload, and_(Upload.organization_id == Org.id, Upload.status == "completed"))
+        .outerjoin(Chunk, and_(Chunk.upload_id == Upload.id, Chunk.duplicate_of_id.is_(None)))
+        .where(Org.project_id == project_id)
+        .order_by(Org.id, Upload.id, Chunk.id)
+        .execution_options(yield_per=ANALYSIS_CONTEXT_FETCH_SIZE)
+    )
+    result = db.execute(query)
+    try:
+        last_org_id, emitted = None, False
+        for org_id, name, is_base, filename, content in result:
+            if org_id != last_org_id:
+                if last_org_id is not None and not emitted:
+                    yield org, None
+                org, last_org_id, emitted = OrgInfo(org_id, name, is_base), org_id, False
+            if content is not None:
+                emitted = True
+                yield org, f"Source: {filename}, Content: {content}\n"
+        if last_org_id is not None and not emitted:
+            yield org, None
+    finally:
+        result.close()
+
+def build_single_context(db: Session, project_id: int, max_tokens: int = None):
+    """Build the single-pass prompt context, or return None once it exceeds max_tokens."""
+    parts, used, current_org_id = [], 0, None
+    for org, line in iter_context_rows(db, project_id):
+        if org.id != current_org_id:
+            parts.append(org_header(org))
+            current_org_id = org.id
+        if line is None:
+            continue
+        used += count_tokens(line, ANALYSIS_MODEL)
+        if max_tokens is not None and used > max_tokens:
+            return None
+        parts.append(line)
+    return "".join(parts)
+
+def iter_org_segments(db: Session, project_id: int, max_tokens: int):
+    """Yield (OrgInfo, segment) with each segment at most max_tokens (a single oversize line stands alone)."""
+    current_org, parts, used = None, [], 0
+    for org, line in iter_context_rows(db, project_id):
+        if current_org is not None and org.id != current_org.id:
+            yield current_org, "".join(parts) or "(no documents uploaded)"
+            parts, used = [], 0
+        current_org = org
+        if line is None:
+            continue
+        tokens = count_tokens(line, ANALYSIS_MODEL)
+        if parts and used + tokens > max_tokens:
+            yield org, "".join(parts)
+            parts, used = [], 0
+        parts.append(line)
+        used += tokens
+    if current_org is not None:
+        yield current_org, "".join(parts) or "(no documents uploaded)"
+
+def complete_json(system_prompt: str, user_prompt: str, model: str = ANALYSIS_MODEL):
+    response = openai_client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        response_format={"type": "json_object"}
+    )
+    return json.loads(response.choices[0].message.content)
+
+def map_org_segment(org, segment: str):
+    role = "Base" if org.is_base else "Competitor"
+    profile = complete_json(
+        MAP_SYSTEM_PROMPT,
+        f"Organization: {org.name} ({role})\nDocuments:\n{segment}\nReturn valid JSON.",
+        model=ANALYSIS_MAP_MODEL,
+    )
+    profile["organization"] = org.name
+    profile["role"] = role
+    return profile
+
+def _report(on_progress, stage: str, percent: int):
+    if on_progress:
+        on_progress(stage, percent)
+
+def run_map_reduce(db: Session, project_id: int, analysis_goal: str, on_progress=None):
+    """Condense each organization concurrently, then compare the profiles in one reduce call.
+
+    Segments are submitted to the pool as they are read from the database, and at
+    most twice ANALYSIS_MAP_CONCURRENCY segments are held in memory at once.
+    Organizations whose documents exceed ANALYSIS_MAP_SEGMENT_TOKENS are split into
+    several map calls; every partial profile is passed to the reduce step.
+    """
+    futures = []
+    slots = threading.BoundedSemaphore(ANALYSIS_MAP_CONCURRENCY * 2)
+    with ThreadPoolExecutor(max_workers=ANALYSIS_MAP_CONCURRENCY) as pool:
+        for org, segment in iter_org_segments(db, project_id, ANALYSIS_MAP_SEGMENT_TOKENS):
+            slots.acquire()
+            future = pool.submit(map_org_segment, org, segment)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        logger.info(f"Map-reduce analysis: {len(futures)} map calls for project {project_id}")
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            _report(on_progress, "Condensing organizations", 10 + int(70 * done / len(futures)))
+    profiles = [future.result() for future in futures]
+
+    _report(on_progress, "Comparing organizations", 85)
+
+    user_prompt = (
+        f"Organization profiles (condensed from each organization's documents):\n"
+        f"{json.dumps(profiles, indent=1)}\n\n{analysis_goal}\nReturn valid JSON."
+    )
+    return complete_json(SYSTEM_PROMPT, user_prompt)
+
+def generate_analysis(project_id: int, db: Session, constraints: dict = None, on_progress=None):
+    """Run the analysis and save a new AnalysisResult version.
+
+    `on_progress(stage, percent)` is called as the run advances, for job tracking.
+    """
+    logger.info(f"Starting analysis for project {project_id}")
+    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    if not project:
+        logger.error(f"Project NOT found: {project_id}")
+        return None
+
+    # Fingerprint before reading chunks so a result never claims inputs newer than it saw
+    fingerprint = compute_fingerprint(db, project_id, constraints)
+
     analysis_goal = "Perform a deep market and competitor analysis."
     if constraints:
         analysis_goal += f"\nApply the following constraints: {json.dumps(constraints)}"
 
-    user_prompt = f"Context:\n{all_context}\n\n{analysis_goal}\nReturn valid JSON."
+    # Get all chunks for this project, streamed straight into the prompt builder
+    _report(on_progress, "Collecting documents", 5)
+    all_context = None
+    if ANALYSIS_MODE == "single":
+        all_context = build_single_context(db, project_id)
+    elif ANALYSIS_MODE == "auto":
+        # Stops reading as soon as the context outgrows a single pass
+        all_context = build_single_context(db, project_id, max_tokens=ANALYSIS_SINGLE_PASS_MAX_TOKENS)
 
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        result_json = json.loads(response.choices[0].message.content)
+        if all_context is None:
+            result_json = run_map_reduce(db, project_id, analysis_goal, on_progress)
+        else:
+            _report(on_progress, "Analyzing", 20)
+            user_prompt = f"Context:\n{all_context}\n\n{analysis_goal}\nReturn valid JSON."
+            result_json = complete_json(SYSTEM_PROMPT, user_prompt)
 
     except Exception as e:
         logger.error(f"OpenAI API failed: {str(e)}")
+        # Never cache the fallback, so the next run retries the real analysis
+        fingerprint = None
         # Construct a high-quality mock result for demonstration/fallback
         result_json = {
             "comparison": [
@@ -115,11 +348,13 @@ def generate_analysis(project_id: int, db: Session, constraints: dict = None):
         }
 
     # Save result
+    _report(on_progress, "Saving result", 95)
     db_result = models.AnalysisResult(
         project_id=project_id,
         results_json=result_json,
         constraints=constraints,
-        version=(db.query(models.AnalysisResult).filter(models.AnalysisResult.project_id == project_id).count() + 1)
+        fingerprint=fingerprint,
+        version=_next_version(db, project_id)
     )
     db.add(db_result)
     db.commit()
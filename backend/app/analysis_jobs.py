@@ -0,0 +1,96 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+from datetime import datetime, timedelta, timezone
+from app import models
+from app.analysis import compute_fingerprint, find_cached_result, reuse_cached_result
+import os
+
+# Running jobs not updated for this long are assumed lost (e.g. worker restarted)
+ANALYSIS_JOB_TIMEOUT_SECONDS = int(os.getenv("ANALYSIS_JOB_TIMEOUT_SECONDS", "1800"))
+# Queued jobs wait behind document ingestion on the same worker, so they only expire
+# once their message is almost certainly lost (e.g. Redis was flushed)
+ANALYSIS_JOB_QUEUE_TIMEOUT_SECONDS = int(os.getenv("ANALYSIS_JOB_QUEUE_TIMEOUT_SECONDS", str(6 * 3600)))
+
+ACTIVE_STATUSES = ("queued", "running")
+# Lookup/insert rounds before giving up when concurrent requests keep racing for the same job
+CREATE_ATTEMPTS = 3
+
+def expire_stale_jobs(db: Session, project_id: int):
+    """Mark the project's running jobs without progress for ANALYSIS_JOB_TIMEOUT_SECONDS, and
+    queued jobs older than ANALYSIS_JOB_QUEUE_TIMEOUT_SECONDS, as failed."""
+    now = datetime.now(timezone.utc)
+    for status, timeout in (("running", ANALYSIS_JOB_TIMEOUT_SECONDS), ("queued", ANALYSIS_JOB_QUEUE_TIMEOUT_SECONDS)):
+        db.query(models.AnalysisJob).filter(
+            models.AnalysisJob.project_id == project_id,
+            models.AnalysisJob.status == status,
+            models.AnalysisJob.updated_at < now - timedelta(seconds=timeout),
+        ).update({"status": "failed", "error": "Timed out"}, synchronize_session=False)
+    db.commit()
+
+def _find_active_job(db: Session, project_id: int, dedup_key: str):
+    return db.query(models.AnalysisJob).filter(
+        models.AnalysisJob.project_id == project_id,
+        models.AnalysisJob.dedup_key == dedup_key,
+        models.AnalysisJob.status.in_(ACTIVE_STATUSES),
+    ).first()
+
+def get_or_create_job(db: Session, project_id: int, constraints: dict = None):
+    """Return (job, created).
+
+    Jobs are keyed by the fingerprint of the analysis inputs. If a result for the same
+    fingerprint already exists, a completed job pointing at it is returned without
+    running the model; a queued or running job with the same inputs is joined.
+    """
+    fingerprint = compute_fingerprint(db, project_id, constraints)
+
+    for _ in range(CREATE_ATTEMPTS):
+        cached = find_cached_result(db, project_id, fingerprint)
+        if cached:
+            result = reuse_cached_result(db, cached)
+            job = models.AnalysisJob(
+                project_id=project_id, constraints=constraints, dedup_key=fingerprint,
+                status="completed", stage="Cached", progress=100, result_id=result.id,
+            )
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            return job, False
+
+        expire_stale_jobs(db, project_id)
+        job = _find_active_job(db, project_id, fingerprint)
+        if job:
+            return job, False
+
+        job = models.AnalysisJob(project_id=project_id, constraints=constraints, dedup_key=fingerprint, status="queued", progress=0)
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another request created the same job between our lookup and insert. Look
+            # again: join it if still active, reuse its result or create a job if it ended
+            db.rollback()
+            continue
+        db.refresh(job)
+        return job, True
+    raise RuntimeError(f"Could not create an analysis job for project {project_id}")
+
+def transition_job(db: Session, job, from_statuses, **fields) -> bool:
+    """Apply fields only while the job is still in one of from_statuses.
+
+    A conditional UPDATE, so a job that a status poll expired meanwhile is not
+    started or overwritten by a late worker. Returns whether the job was updated.
+    """
+    updated = db.query(models.AnalysisJob).filter(
+        models.AnalysisJob.id == job.id,
+        models.AnalysisJob.status.in_(from_statuses),
+    ).update({**fields, "updated_at": func.now()}, synchronize_session=False)
+    db.commit()
+    db.refresh(job)
+    return bool(updated)
+
+def update_job(db: Session, job, **fields):
+    for key, value in fields.items():
+        setattr(job, key, value)
+    job.updated_at = func.now()
+    db.commit()
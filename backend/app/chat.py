@@ -0,0 +1,272 @@
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app import models
+from app.database import get_session_local
+from app.openai_client import openai_client, async_openai_client
+from app.retrieval import search_diverse
+from common.tokens import count_tokens, truncate_to_tokens
+import anyio
+import json
+import os
+
+CHAT_MODEL = "gpt-4o"
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+# Total prompt tokens for system context, summary, history and the new message
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "12000"))
+CHAT_RAG_TOKEN_BUDGET = int(os.getenv("CHAT_RAG_TOKEN_BUDGET", "2500"))
+CHAT_ANALYSIS_TOKEN_BUDGET = int(os.getenv("CHAT_ANALYSIS_TOKEN_BUDGET", "4000"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "800"))
+# Transcript tokens sent per summary call; older turns are folded in several calls
+CHAT_SUMMARY_INPUT_TOKENS = int(os.getenv("CHAT_SUMMARY_INPUT_TOKENS", "12000"))
+CHAT_SUMMARY_MESSAGE_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MESSAGE_MAX_TOKENS", "2000"))
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "20"))
+# Approximate per-message framing overhead in the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def _tokens(text: str) -> int:
+    return count_tokens(text, CHAT_MODEL)
+
+def _fit_rag_context(results) -> str:
+    lines, used = [], 0
+    for r in results:
+        line = f"- {r.content}"
+        tokens = _tokens(line)
+        if used + tokens > CHAT_RAG_TOKEN_BUDGET:
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(lines)
+
+def iter_history_newest_first(db: Session, project_id: int, after_id: int = 0):
+    """Yield a project's chat messages newest first, one page at a time (keyset pagination)."""
+    before_id = None
+    while True:
+        query = db.query(models.ChatMessage).filter(
+            models.ChatMessage.project_id == project_id,
+            models.ChatMessage.id > after_id,
+        )
+        if before_id is not None:
+            query = query.filter(models.ChatMessage.id < before_id)
+        page = query.order_by(models.ChatMessage.id.desc()).limit(CHAT_HISTORY_PAGE_SIZE).all()
+        yield from page
+        if len(page) < CHAT_HISTORY_PAGE_SIZE:
+            return
+        before_id = page[-1].id
+
+def build_chat_messages(db: Session, project_id: int, message: str, query_embedding=None):
+    """Assemble the system prompt, history and user turn for a project chat within a token budget.
+
+    Retrieved chunks and the analysis snapshot are capped at their own budgets; the
+    remainder is filled with the most recent turns, preceded by the project's rolling
+    summary of older turns. Returns (messages, analysis_result, fold_before_id), where
+    fold_before_id is set when unsummarized turns fell out of the window and should be
+    folded into the summary with `refresh_chat_summary`. Runs synchronous queries, so
+    async callers should execute it in a threadpool.
+    """
+    # 1. Retrieve RAG Context (Chunks)
+    rag_context = "Context unavailable due to AI service limit."
+    if query_embedding is not None:
+        try:
+            # Diverse chunks that already fit the budget: fewer near-identical passages in the prompt
+            results = search_diverse(
+                db, project_id, query_embedding, limit=5,
+                max_tokens=CHAT_RAG_TOKEN_BUDGET, token_cost=lambda content: _tokens(f"- {content}"),
+            )
+            rag_context = _fit_rag_context(results)
+        except Exception as e:
+            print(f"Vector search failed: {e}")
+            db.rollback()
+
+    # 2. Retrieve Latest Analysis Result
+    analysis_result = db.query(models.AnalysisResult).filter(
+        models.AnalysisResult.project_id == project_id
+    ).order_by(models.AnalysisResult.version.desc()).first()
+
+    analysis_context = ""
+    if analysis_result:
+        snapshot = truncate_to_tokens(
+            json.dumps(analysis_result.results_json, separators=(",", ":")), CHAT_ANALYSIS_TOKEN_BUDGET, CHAT_MODEL
+        )
+        analysis_context = f"\n\nLATEST ANALYSIS RESULT:\n{snapshot}"
+
+    summary = db.query(models.ChatSummary).filter(models.ChatSummary.project_id == project_id).first()
+    summary_context = ""
+    if summary:
+        summary_context = f"SUMMARY OF EARLIER CONVERSATION:\n    {summary.summary}\n"
+
+    # 3. Construct System Prompt
+    system_instruction = f"""You are an intelligent assistant for this analysis project.
+
+    CONTEXT FROM DOCUMENTS:
+    {rag_context}
+
+    {analysis_context}
+
+    {summary_context}
+    INSTRUCTIONS:
+    - Use the 'LATEST ANALYSIS RESULT' to answer questions about recommendations, confidence scores, and comparisons.
+    - If the user asks to validate or refine the output, explain the reasoning based on the 'results_json' or suggest they use the 'Refine Analysis' button for structural changes.
+    - Use 'CONTEXT FROM DOCUMENTS' to verify specific claims or provide raw evidence.
+    """
+
+    # 4. Fill the remaining budget with the newest turns
+    history_budget = CHAT_CONTEXT_TOKEN_BUDGET - _tokens(system_instruction) - _tokens(message) - 2 * MESSAGE_OVERHEAD_TOKENS
+    history, used = [], 0
+    fold_before_id = None
+    keep_boundary_id = None
+    for msg in iter_history_newest_first(db, project_id, after_id=summary.summarized_through_id if summary else 0):
+        tokens = _tokens(msg.content or "") + MESSAGE_OVERHEAD_TOKENS
+        if used + tokens > history_budget:
+            # Fold down to half the window so the summary isn't rewritten on every turn
+            fold_before_id = keep_boundary_id or msg.id + 1
+            break
+        history.append(msg)
+        used += tokens
+        if used <= history_budget // 2:
+            keep_boundary_id = msg.id
+
+    msg_list = [{"role": "system", "content": system_instruction}]
+    for msg in reversed(history):
+        msg_list.append({"role": msg.role, "content": msg.content})
+    msg_list.append({"role": "user", "content": message})
+    return msg_list, analysis_result, fold_before_id
+
+def _iter_turn_batches(db: Session, project_id: int, after_id: int, before_id: int):
+    """Yield lists of (message_id, transcript_line) of at most CHAT_SUMMARY_INPUT_TOKENS each, oldest first.
+
+    A single message longer than CHAT_SUMMARY_MESSAGE_MAX_TOKENS is truncated so one
+    huge turn cannot make a batch exceed the model's context.
+    """
+    batch, used = [], 0
+    while True:
+        page = db.query(models.ChatMessage.id, models.ChatMessage.role, models.ChatMessage.content).filter(
+            models.ChatMessage.project_id == project_id,
+            models.ChatMessage.id > after_id,
+            models.ChatMessage.id < before_id,
+        ).order_by(models.ChatMessage.id.asc()).limit(CHAT_HISTORY_PAGE_SIZE).all()
+        for m in page:
+            line = truncate_to_tokens(f"{m.role.upper()}: {m.content}", CHAT_SUMMARY_MESSAGE_MAX_TOKENS, CHAT_SUMMARY_MODEL)
+            tokens = count_tokens(line, CHAT_SUMMARY_MODEL)
+            if batch and used + tokens > CHAT_SUMMARY_INPUT_TOKENS:
+                yield batch
+                batch, used = [], 0
+            batch.append((m.id, line))
+            used += tokens
+        if len(page) < CHAT_HISTORY_PAGE_SIZE:
+            break
+        after_id = page[-1].id
+    if batch:
+        yield batch
+
+def _merge_summary(previous: str, transcript: str) -> str:
+    response = openai_client.chat.completions.create(
+        model=CHAT_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": (
+                "You maintain a running summary of a conversation about a market and competitor analysis project. "
+                "Merge the new turns into the existing summary. Keep facts, decisions, user preferences and open "
+                f"questions; drop pleasantries. Stay under {CHAT_SUMMARY_MAX_TOKENS} tokens."
+            )},
+            {"role": "user", "content": f"EXISTING SUMMARY:\n{previous}\n\nNEW TURNS:\n{transcript}"},
+        ],
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+    )
+    return response.choices[0].message.content
+
+def refresh_chat_summary(project_id: int, fold_before_id: int):
+    """Fold chat messages older than fold_before_id into the project's rolling summary.
+
+    Turns are folded in batches bounded by CHAT_SUMMARY_INPUT_TOKENS, committing the
+    summary after each, so a long backlog is worked through instead of failing as one
+    oversized call, and an error keeps the batches already folded.
+    """
+    db = get_session_local()()
+    try:
+        summary = db.query(models.ChatSummary).filter(models.ChatSummary.project_id == project_id).first()
+        after_id = summary.summarized_through_id if summary else 0
+        if after_id >= fold_before_id - 1:
+            return
+        for batch in _iter_turn_batches(db, project_id, after_id, fold_before_id):
+            text = _merge_summary(summary.summary if summary else "(none)", "\n".join(line for _, line in batch))
+            if summary is None:
+                summary = models.ChatSummary(project_id=project_id)
+                db.add(summary)
+            summary.summary = text
+            summary.summarized_through_id = batch[-1][0]
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Chat summary refresh failed for project {project_id}: {e}")
+    finally:
+        db.close()
+
+def offline_answer(analysis_result):
+    """Smart Fallback: Use analysis data if available to simulate a response."""
+    if analysis_result and "recommendations" in analysis_result.results_json:
+        rec = analysis_result.results_json["recommendations"][0]
+        return f"**Simulated Response (Offline Mode):**\n\nBased on your strategy report, I highly recommend you focus on **{rec['title']}**. This is a high-impact area with {rec['confidence']}% confidence.\n\n(Note: Live AI reasoning is currently unavailable, providing insights from cached analysis.)"
+    return "I'm currently operating in offline mode. Please check your network or API quota. I can still help you review the static report on the dashboard."
+
+def save_chat_turn(db: Session, project_id: int, message: str, answer: str):
+    db.add(models.ChatMessage(project_id=project_id, role="user", content=message))
+    db.add(models.ChatMessage(project_id=project_id, role="assistant", content=answer))
+    db.commit()
+
+def persist_chat_turn(project_id: int, message: str, answer: str):
+    """Save a chat turn with its own session, for use after the request's session has closed."""
+    db = get_session_local()()
+    try:
+        save_chat_turn(db, project_id, message, answer)
+    finally:
+        db.close()
+
+def sse_event(data: dict, event: str = None) -> str:
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n{payload}"
+    return payload
+
+async def stream_chat_events(request, project_id: int, message: str, msg_list, analysis_result):
+    """Yield the completion as server-sent events and persist the turn once it finishes.
+
+    Each token arrives as a `data: {"token": ...}` event and the full text as a final
+    `done` event. If the client goes away the upstream OpenAI stream is closed
+    immediately so generation stops, and whatever was produced so far is saved.
+    """
+    parts = []
+    stream = None
+    saved = False
+    try:
+        try:
+            stream = await async_openai_client.chat.completions.create(model=CHAT_MODEL, messages=msg_list, stream=True)
+        except Exception as e:
+            print(f"Chat stream failed to start: {e}")
+            parts.append(offline_answer(analysis_result))
+            yield sse_event({"token": parts[0]})
+        else:
+            try:
+                async for chunk in stream:
+                    if await request.is_disconnected():
+                        print(f"Client left project {project_id} chat, stopping completion stream")
+                        return
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event({"token": delta})
+            except Exception as e:
+                print(f"Chat stream interrupted: {e}")
+                yield sse_event({"error": "The response was interrupted. Please try again."}, event="error")
+
+        answer = "".join(parts)
+        if answer:
+            await run_in_threadpool(persist_chat_turn, project_id, message, answer)
+            saved = True
+        yield sse_event({"answer": answer}, event="done")
+    finally:
+        # Runs on normal completion, on disconnect and on cancellation; shield the
+        # cleanup so a cancelled response still releases OpenAI and saves the turn
+        with anyio.CancelScope(shield=True):
+            if stream is not None:
+                await stream.response.aclose()
+            if parts and not saved:
+                await run_in_threadpool(persist_chat_turn, project_id, message, "".join(parts))
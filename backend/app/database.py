@@ -8,6 +8,12 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "")
 
+# Where chunk vectors are searched: "pgvector" (needs the extension) or "numpy"
+# (app.numpy_index, for plain Postgres or SQLite). Defaults to pgvector on Postgres.
+RETRIEVAL_BACKEND = os.getenv(
+    "RETRIEVAL_BACKEND", "pgvector" if SQLALCHEMY_DATABASE_URL.startswith("postgres") else "numpy"
+).lower()
+
 # Lazy engine initialization
 _engine = None
 _SessionLocal = None
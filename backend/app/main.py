@@ -1,23 +1,39 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile
+from fastapi import FastAPI, Depends, HTTPException, status, Request, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from typing import List
 from app import models, schemas, database, auth
-from app.database import get_engine, get_db
+from app.database import get_engine, get_db, RETRIEVAL_BACKEND
 from app.auth import get_password_hash, verify_password, create_access_token, get_current_user, check_role
-from common.s3_utils import S3Service
-from worker.tasks import process_document
-from app.analysis import generate_analysis
-from app.openai_client import openai_client
+from common.s3_utils import S3Service, UploadTooLargeError, UPLOAD_PART_SIZE
+from worker.dispatch import enqueue_process_document, enqueue_analysis_job
+from worker import embedding_cache
+from app.analysis_jobs import get_or_create_job, update_job, expire_stale_jobs
+from app.uploads import MultipartFileReceiver, UPLOAD_MAX_BYTES, UPLOAD_OPENAPI
+from app.migrations import apply_schema_upgrades, start_background_migrations
+from app.openai_client import async_openai_client, embedding_options, EMBEDDING_MODEL
+from app.chat import build_chat_messages, offline_answer, save_chat_turn, stream_chat_events, refresh_chat_summary, CHAT_MODEL
+from starlette.concurrency import run_in_threadpool
 from typing import Optional
 import uuid
 import os
-import json
 from datetime import datetime, timedelta
 
 from sqlalchemy import text
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="Analyzer API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema upgrades must land before requests touch new columns; the slow
+    # backfill and index build continue in a background thread
+    try:
+        await run_in_threadpool(ensure_db_initialized)
+    except Exception:
+        print("⚠ Database not ready at startup; initialization is retried on registration")
+    yield
+
+app = FastAPI(title="Analyzer API", lifespan=lifespan)
 
 # Health check endpoint
 @app.get("/health")
@@ -39,15 +55,20 @@ def ensure_db_initialized():
         
         # Create vector extension (required for pgvector)
         vector_available = False
-        try:
-            with engine.connect() as conn:
-                conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-                conn.commit()
+        if RETRIEVAL_BACKEND != "pgvector":
+            # Embeddings are stored as bytes and searched with app.numpy_index
             vector_available = True
-            print("✓ Vector extension ready")
-        except Exception as e:
-            print(f"⚠ Vector extension not available: {str(e)[:100]}")
-            print("⚠ RAG features will be disabled")
+            print(f"✓ Using {RETRIEVAL_BACKEND} retrieval backend")
+        else:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+                    conn.commit()
+                vector_available = True
+                print("✓ Vector extension ready")
+            except Exception as e:
+                print(f"⚠ Vector extension not available: {str(e)[:100]}")
+                print("⚠ RAG features will be disabled; set RETRIEVAL_BACKEND=numpy to search chunks without pgvector")
         
         # Create tables - try to create all, but handle vector table failures
         try:
@@ -66,8 +87,9 @@ def ensure_db_initialized():
                 print("Attempting to create core tables without vector...")
                 try:
                     # Create tables one by one, skipping vector-dependent ones
+                    vector_tables = {"extracted_chunks", "embedding_cache", "chunk_lsh_bands"}
                     for table in models.Base.metadata.sorted_tables:
-                        if table.name != "extracted_chunks":  # Skip vector table
+                        if table.name not in vector_tables:  # Skip vector tables
                             try:
                                 table.create(engine, checkfirst=True)
                             except Exception as table_error:
@@ -76,6 +98,15 @@ def ensure_db_initialized():
                 except Exception as core_error:
                     print(f"❌ Core tables failed: {str(core_error)[:100]}")
         
+        try:
+            apply_schema_upgrades(engine)
+            print("✓ Schema upgrades applied")
+            if vector_available:
+                # Backfill and ANN index build can take minutes; don't hold up requests
+                start_background_migrations(engine)
+        except Exception as e:
+            print(f"⚠ Schema upgrades failed: {str(e)[:200]}")
+        
         _db_initialized = True
         print("✅ Database initialized")
     except Exception as e:
@@ -229,6 +260,12 @@ def update_user(
     db.refresh(target_user)
     return target_user
 
+@app.get("/admin/embedding-cache")
+def get_embedding_cache_stats(
+    current_user: models.User = Depends(check_role(["super_admin", "admin"]))
+):
+    return embedding_cache.get_stats()
+
 # --- PROJECT ROUTES ---
 
 @app.post("/projects", response_model=schemas.Project)
@@ -269,42 +306,77 @@ def list_projects(
 
 # (Keep upload, run-analysis, results, and chat routes, but add auth dependencies)
 
-@app.post("/uploads/{project_id}/{org_id}")
+def _save_upload(db: Session, project_id: int, org_id: int, filename: str, content_type: str, s3_key: str, size: int, content_hash: str):
+    db_upload = models.Upload(
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        content_hash=content_hash,
+        s3_key=s3_key,
+        project_id=project_id,
+        organization_id=org_id,
+        status="pending"
+    )
+    db.add(db_upload)
+    db.commit()
+    db.refresh(db_upload)
+    enqueue_process_document(db_upload.id)
+    return db_upload
+
+@app.post("/uploads/{project_id}/{org_id}", openapi_extra=UPLOAD_OPENAPI)
 async def upload_file(
     project_id: int, 
     org_id: int, 
-    file: UploadFile = File(...), 
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Verify ownership
-    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    project = await run_in_threadpool(
+        lambda: db.query(models.Project).filter(models.Project.id == project_id).first()
+    )
     if not project or (project.owner_id != current_user.id and current_user.role != "super_admin"):
         raise HTTPException(status_code=403, detail="Not authorized")
 
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail="File too large")
+    try:
+        receiver = MultipartFileReceiver(request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     s3 = S3Service()
-    s3.create_bucket_if_not_exists()
-    
-    file_id = str(uuid.uuid4())
-    s3_key = f"{project_id}/{org_id}/{file_id}_{file.filename}"
-    s3.upload_fileobj(file.file, s3_key)
-    
-    db_upload = models.Upload(
-        filename=file.filename,
-        content_type=file.content_type,
-        size=0,
-        s3_key=s3_key,
-        project_id=project_id,
-        organization_id=org_id,
-        status="pending"
+    await run_in_threadpool(s3.ensure_bucket)
+
+    # The body is parsed as it arrives and forwarded to S3 a part at a time, so the
+    # file is never spooled whole; size and sha256 are computed along the way
+    writer = None
+    try:
+        async for chunk in request.stream():
+            receiver.feed(chunk)
+            if writer is None and receiver.filename:
+                s3_key = f"{project_id}/{org_id}/{uuid.uuid4()}_{receiver.filename}"
+                writer = s3.open_stream_writer(s3_key, receiver.content_type, max_bytes=UPLOAD_MAX_BYTES)
+            if writer is not None and (receiver.pending_bytes >= UPLOAD_PART_SIZE or receiver.finished):
+                await run_in_threadpool(writer.write, receiver.take())
+        if writer is None or not receiver.finished:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+        await run_in_threadpool(writer.close)
+    except UploadTooLargeError:
+        await run_in_threadpool(writer.abort)
+        raise HTTPException(status_code=413, detail="File too large")
+    except BaseException:
+        if writer is not None:
+            await run_in_threadpool(writer.abort)
+        raise
+
+    return await run_in_threadpool(
+        _save_upload, db, project_id, org_id, receiver.filename, receiver.content_type,
+        writer.object_name, writer.size, writer.sha256
     )
-    db.add(db_upload)
-    db.commit()
-    db.refresh(db_upload)
-    process_document.delay(db_upload.id)
-    return db_upload
 
-@app.post("/projects/{project_id}/run-analysis")
+@app.post("/projects/{project_id}/run-analysis", response_model=schemas.AnalysisJob, status_code=status.HTTP_202_ACCEPTED)
 def run_analysis(
     project_id: int, 
     constraints: Optional[dict] = None, 
@@ -315,8 +387,35 @@ def run_analysis(
     if not project or (project.owner_id != current_user.id and current_user.role != "super_admin"):
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    result = generate_analysis(project_id, db, constraints)
-    return result
+    # Analysis runs on the Celery worker; repeated clicks join the job already in flight
+    job, created = get_or_create_job(db, project_id, constraints)
+    if created:
+        try:
+            enqueue_analysis_job(job.id)
+        except Exception as e:
+            update_job(db, job, status="failed", error=f"Could not enqueue job: {e}")
+            raise HTTPException(status_code=503, detail="Analysis queue unavailable")
+    return job
+
+@app.get("/projects/{project_id}/analysis-jobs/{job_id}", response_model=schemas.AnalysisJob)
+def get_analysis_job(
+    project_id: int,
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+    if not project or (project.owner_id != current_user.id and current_user.role != "super_admin"):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    # A job whose worker died stops updating; report it as failed instead of running forever
+    expire_stale_jobs(db, project_id)
+    job = db.query(models.AnalysisJob).filter(
+        models.AnalysisJob.id == job_id, models.AnalysisJob.project_id == project_id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.get("/projects/{project_id}/results")
 def get_results(
@@ -333,70 +432,66 @@ def get_results(
         return None
     return result
 
-@app.post("/projects/{project_id}/chat")
-async def chat(
-    project_id: int, 
-    message: str, 
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    project = db.query(models.Project).filter(models.Project.id == project_id).first()
+async def prepare_chat(db: Session, project_id: int, message: str, current_user: models.User):
+    """Authorize the chat and build its prompt without blocking the event loop."""
+    project = await run_in_threadpool(
+        lambda: db.query(models.Project).filter(models.Project.id == project_id).first()
+    )
     if not project or (project.owner_id != current_user.id and current_user.role != "super_admin"):
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    # 1. Retrieve RAG Context (Chunks)
     try:
-        query_embedding = openai_client.embeddings.create(input=[message], model="text-embedding-3-small").data[0].embedding
-        results = db.query(models.ExtractedChunk).join(models.Upload).filter(
-            models.Upload.project_id == project_id
-        ).order_by(models.ExtractedChunk.embedding.l2_distance(query_embedding)).limit(5).all()
-        rag_context = "\n".join([f"- {r.content}" for r in results])
+        embedding_response = await async_openai_client.embeddings.create(
+            input=[message], model=EMBEDDING_MODEL, **embedding_options()
+        )
+        query_embedding = embedding_response.data[0].embedding
     except Exception as e:
         print(f"Embedding failed: {e}")
-        rag_context = "Context unavailable due to AI service limit."
+        query_embedding = None
 
-    # 2. Retrieve Latest Analysis Result
-    analysis_result = db.query(models.AnalysisResult).filter(
-        models.AnalysisResult.project_id == project_id
-    ).order_by(models.AnalysisResult.version.desc()).first()
-    
-    analysis_context = ""
-    if analysis_result:
-        analysis_context = f"\n\nLATEST ANALYSIS RESULT:\n{json.dumps(analysis_result.results_json, indent=2)}"
+    return await run_in_threadpool(build_chat_messages, db, project_id, message, query_embedding)
 
-    # 3. Construct System Prompt
-    system_instruction = f"""You are an intelligent assistant for this analysis project.
-    
-    CONTEXT FROM DOCUMENTS:
-    {rag_context}
-    
-    {analysis_context}
-    
-    INSTRUCTIONS:
-    - Use the 'LATEST ANALYSIS RESULT' to answer questions about recommendations, confidence scores, and comparisons.
-    - If the user asks to validate or refine the output, explain the reasoning based on the 'results_json' or suggest they use the 'Refine Analysis' button for structural changes.
-    - Use 'CONTEXT FROM DOCUMENTS' to verify specific claims or provide raw evidence.
-    """
+@app.post("/projects/{project_id}/chat")
+async def chat(
+    project_id: int, 
+    message: str, 
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # Sync DB work runs in the threadpool and OpenAI calls are awaited, so a slow
+    # completion never blocks the event loop for other requests
+    msg_list, analysis_result, fold_before_id = await prepare_chat(db, project_id, message, current_user)
 
-    history = db.query(models.ChatMessage).filter(models.ChatMessage.project_id == project_id).order_by(models.ChatMessage.created_at.asc()).all()
-    
-    msg_list = [{"role": "system", "content": system_instruction}]
-    for msg in history:
-        msg_list.append({"role": msg.role, "content": msg.content})
-    msg_list.append({"role": "user", "content": message})
-    
     try:
-        response = openai_client.chat.completions.create(model="gpt-4o", messages=msg_list)
+        response = await async_openai_client.chat.completions.create(model=CHAT_MODEL, messages=msg_list)
         answer = response.choices[0].message.content
     except Exception as e:
-        # Smart Fallback: Use analysis data if available to simulate a response
-        if analysis_result and "recommendations" in analysis_result.results_json:
-            rec = analysis_result.results_json["recommendations"][0]
-            answer = f"**Simulated Response (Offline Mode):**\n\nBased on your strategy report, I highly recommend you focus on **{rec['title']}**. This is a high-impact area with {rec['confidence']}% confidence.\n\n(Note: Live AI reasoning is currently unavailable, providing insights from cached analysis.)"
-        else:
-            answer = "I'm currently operating in offline mode. Please check your network or API quota. I can still help you review the static report on the dashboard."
+        answer = offline_answer(analysis_result)
 
-    db.add(models.ChatMessage(project_id=project_id, role="user", content=message))
-    db.add(models.ChatMessage(project_id=project_id, role="assistant", content=answer))
-    db.commit()
+    await run_in_threadpool(save_chat_turn, db, project_id, message, answer)
+    if fold_before_id:
+        background_tasks.add_task(refresh_chat_summary, project_id, fold_before_id)
     return {"answer": answer}
+
+@app.post("/projects/{project_id}/chat/stream")
+async def chat_stream(
+    project_id: int,
+    message: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # The prompt is built before streaming starts; the request's session is closed
+    # by the time tokens flow, so the turn is persisted with a fresh session
+    msg_list, analysis_result, fold_before_id = await prepare_chat(db, project_id, message, current_user)
+    background = None
+    if fold_before_id:
+        background = BackgroundTasks()
+        background.add_task(refresh_chat_summary, project_id, fold_before_id)
+    return StreamingResponse(
+        stream_chat_events(request, project_id, message, msg_list, analysis_result),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background,
+    )
@@ -0,0 +1,133 @@
+"""
+Idempotent, online schema upgrades for databases created by older versions.
+
+`create_all` only creates missing tables, so columns and indexes added to existing
+tables are applied here. Every statement is safe to re-run and avoids long locks:
+new columns are nullable without defaults (a catalog-only change in Postgres),
+indexes are built CONCURRENTLY and backfills run in small committed batches.
+"""
+from sqlalchemy import text
+import os
+import threading
+
+BACKFILL_BATCH_SIZE = int(os.getenv("MIGRATION_BACKFILL_BATCH_SIZE", "5000"))
+
+# Arbitrary constant used with pg_try_advisory_lock so only one process runs background migrations
+MIGRATION_LOCK_ID = 7428301
+
+# (table, statement) pairs, applied in order; statements for missing tables are skipped
+SCHEMA_UPGRADES = [
+    ("extracted_chunks", "ALTER TABLE extracted_chunks ADD COLUMN IF NOT EXISTS project_id INTEGER REFERENCES projects(id)"),
+    ("extracted_chunks", "ALTER TABLE extracted_chunks ADD COLUMN IF NOT EXISTS organization_id INTEGER REFERENCES organizations(id)"),
+    ("extracted_chunks", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_extracted_chunks_project_id ON extracted_chunks (project_id)"),
+    ("extracted_chunks", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_extracted_chunks_organization_id ON extracted_chunks (organization_id)"),
+    ("chat_messages", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_messages_project_id_id ON chat_messages (project_id, id)"),
+    ("analysis_results", "ALTER TABLE analysis_results ADD COLUMN IF NOT EXISTS fingerprint VARCHAR(64)"),
+    ("analysis_results", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analysis_results_fingerprint ON analysis_results (fingerprint)"),
+    ("uploads", "ALTER TABLE uploads ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"),
+    ("uploads", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_uploads_content_hash ON uploads (content_hash)"),
+    ("uploads", "ALTER TABLE uploads ADD COLUMN IF NOT EXISTS pipeline_version VARCHAR"),
+    ("extracted_chunks", "ALTER TABLE extracted_chunks ADD COLUMN IF NOT EXISTS minhash BYTEA"),
+    ("extracted_chunks", "ALTER TABLE extracted_chunks ADD COLUMN IF NOT EXISTS duplicate_of_id INTEGER REFERENCES extracted_chunks(id)"),
+]
+
+def _autocommit(engine):
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+def table_exists(conn, table_name: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": table_name}).scalar()
+
+def apply_schema_upgrades(engine):
+    """Add columns and plain indexes introduced after a table was first created."""
+    if engine.dialect.name != "postgresql":
+        return
+    with _autocommit(engine) as conn:
+        existing = {}
+        for table_name, statement in SCHEMA_UPGRADES:
+            if table_name not in existing:
+                existing[table_name] = table_exists(conn, table_name)
+            if existing[table_name]:
+                conn.execute(text(statement))
+
+def backfill_chunk_scope(engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Copy project_id/organization_id from uploads onto chunks created before denormalization.
+
+    Runs in short batches so writers are never blocked for long. Returns rows updated.
+    """
+    if engine.dialect.name != "postgresql":
+        return 0
+    total = 0
+    with _autocommit(engine) as conn:
+        while True:
+            updated = conn.execute(text("""
+                UPDATE extracted_chunks AS c
+                SET project_id = u.project_id, organization_id = u.organization_id
+                FROM uploads AS u
+                WHERE c.upload_id = u.id
+                  AND c.id IN (
+                    SELECT id FROM extracted_chunks
+                    WHERE project_id IS NULL AND upload_id IS NOT NULL
+                    LIMIT :batch_size
+                  )
+            """), {"batch_size": batch_size}).rowcount
+            total += updated
+            if updated < batch_size:
+                break
+    if total:
+        print(f"✓ Backfilled project scope on {total} chunks")
+    return total
+
+def backfill_near_duplicate_index(engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Sign and index chunks stored before near-duplicate detection, so new uploads are checked against them.
+
+    Existing near-duplicates are indexed like any other chunk; only new chunks are deduplicated.
+    Returns the number of chunks indexed.
+    """
+    from sqlalchemy import update
+    from sqlalchemy.orm import Session
+    from app import models
+    from worker import near_duplicates
+
+    if engine.dialect.name != "postgresql" or not near_duplicates.NEAR_DUP_ENABLED:
+        return 0
+    Chunk = models.ExtractedChunk
+    total = 0
+    with Session(engine) as db:
+        while True:
+            rows = db.query(Chunk.id, Chunk.content, Chunk.project_id, Chunk.organization_id).filter(
+                Chunk.minhash.is_(None), Chunk.duplicate_of_id.is_(None), Chunk.project_id.isnot(None)
+            ).order_by(Chunk.id).limit(batch_size).all()
+            if not rows:
+                break
+            signatures = [near_duplicates.signature(row.content) for row in rows]
+            db.execute(update(Chunk), [{"id": row.id, "minhash": sig} for row, sig in zip(rows, signatures)])
+            for row, sig in zip(rows, signatures):
+                near_duplicates.index_chunks(db, row.project_id, row.organization_id, [row.id], [sig])
+            db.commit()
+            total += len(rows)
+    if total:
+        print(f"✓ Indexed {total} existing chunks for near-duplicate detection")
+    return total
+
+def run_background_migrations(engine):
+    """Backfill, build the vector index and index old chunks for near-duplicate detection, holding an advisory lock so only one process does it."""
+    from app import vector_index
+
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}).scalar():
+            return
+        try:
+            backfill_chunk_scope(engine)
+            vector_index.ensure_vector_index(engine)
+            backfill_near_duplicate_index(engine)
+        except Exception as e:
+            print(f"⚠ Background migration failed: {str(e)[:200]}")
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            lock_conn.commit()
+
+def start_background_migrations(engine):
+    """Run slow migrations off the request path; the API keeps serving while they finish."""
+    threading.Thread(target=run_background_migrations, args=(engine,), daemon=True).start()
@@ -1,8 +1,31 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON, Float, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, ForeignKey, DateTime, JSON, Float, Boolean, Text, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
+from sqlalchemy.types import TypeDecorator
 from pgvector.sqlalchemy import Vector
-from app.database import Base
+from app.database import Base, RETRIEVAL_BACKEND
+from app.openai_client import EMBEDDING_DIMENSIONS
+import numpy as np
+
+class Embedding(TypeDecorator):
+    """pgvector `vector` column, or little-endian float32 bytes when RETRIEVAL_BACKEND is numpy."""
+    impl = Vector
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if RETRIEVAL_BACKEND == "pgvector":
+            return dialect.type_descriptor(self.impl_instance)
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or RETRIEVAL_BACKEND == "pgvector":
+            return value
+        return np.asarray(value, dtype="<f4").tobytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None or RETRIEVAL_BACKEND == "pgvector":
+            return value
+        return np.frombuffer(value, dtype="<f4")
 
 class User(Base):
     __tablename__ = "users"
@@ -54,24 +77,79 @@ class Upload(Base):
     filename = Column(String, nullable=False)
     content_type = Column(String)
     size = Column(Integer)
+    content_hash = Column(String(64), index=True) # sha256 of the file bytes, computed during upload
     s3_key = Column(String, nullable=False)
     status = Column(String, default="pending") # pending, processing, completed, failed
+    pipeline_version = Column(String) # worker.tasks.PIPELINE_VERSION that produced the chunks
     project_id = Column(Integer, ForeignKey("projects.id"))
     organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=True)
 
     project = relationship("Project", back_populates="uploads")
     chunks = relationship("ExtractedChunk", back_populates="upload")
+    checkpoints = relationship("IngestCheckpoint", back_populates="upload")
+
+class IngestCheckpoint(Base):
+    """Progress cursor for ingesting an upload, or one page range of it when the work is fanned out.
+
+    Chunks are committed in the same transaction that advances units_done, so a
+    retried or re-run task resumes after the last committed unit without duplicates.
+    """
+    __tablename__ = "ingest_checkpoints"
+    id = Column(Integer, primary_key=True, index=True)
+    upload_id = Column(Integer, ForeignKey("uploads.id"), nullable=False)
+    first_page = Column(Integer, nullable=False, default=1)
+    last_page = Column(Integer, nullable=True) # None for a whole-file checkpoint
+    units_done = Column(Integer, nullable=False, default=0) # extracted units (pages, sheets, ...) whose chunks are committed
+    chunks_done = Column(Integer, nullable=False, default=0)
+    completed = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    upload = relationship("Upload", back_populates="checkpoints")
+
+    __table_args__ = (UniqueConstraint("upload_id", "first_page", name="uq_ingest_checkpoints_range"),)
 
 class ExtractedChunk(Base):
     __tablename__ = "extracted_chunks"
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
-    embedding = Column(Vector(1536)) # Assuming OpenAI embeddings
+    embedding = Column(Embedding(EMBEDDING_DIMENSIONS)) # See app.vector_index and app.numpy_index
     metadata_json = Column(JSON) # source info, page, etc.
     upload_id = Column(Integer, ForeignKey("uploads.id"))
+    # Denormalized from Upload so vector search can filter without a join
+    project_id = Column(Integer, ForeignKey("projects.id"), index=True)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), index=True)
+    minhash = Column(LargeBinary) # MinHash signature, see worker.near_duplicates
+    # Set on near-duplicates, which are stored without an embedding and skipped by retrieval and analysis
+    duplicate_of_id = Column(Integer, ForeignKey("extracted_chunks.id"), nullable=True)
 
     upload = relationship("Upload", back_populates="chunks")
 
+class ChunkLshBand(Base):
+    """One LSH band bucket of a chunk's MinHash signature, for finding near-duplicates within a project."""
+    __tablename__ = "chunk_lsh_bands"
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=True)
+    band = Column(SmallInteger, nullable=False)
+    bucket = Column(BigInteger, nullable=False)
+    chunk_id = Column(Integer, ForeignKey("extracted_chunks.id"), nullable=False)
+
+    __table_args__ = (Index("ix_chunk_lsh_bands_lookup", "project_id", "band", "bucket"),)
+
+class EmbeddingCacheEntry(Base):
+    """Cold tier of the embedding cache, keyed by normalized chunk text hash and model."""
+    __tablename__ = "embedding_cache"
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64), nullable=False)
+    model = Column(String, nullable=False)
+    dimensions = Column(Integer, nullable=False)
+    embedding = Column(Embedding(), nullable=False)
+    token_count = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+    __table_args__ = (UniqueConstraint("content_hash", "model", "dimensions", name="uq_embedding_cache_key"),)
+
 class AnalysisResult(Base):
     __tablename__ = "analysis_results"
     id = Column(Integer, primary_key=True, index=True)
@@ -79,11 +157,37 @@ class AnalysisResult(Base):
     version = Column(Integer, default=1)
     results_json = Column(JSON) # Side-by-side, recommendations, scores
     constraints = Column(JSON) # budget, tech stack etc for refinement
+    fingerprint = Column(String(64), index=True) # hash of the inputs, see analysis.compute_fingerprint
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     project = relationship("Project", back_populates="results")
     feedback = relationship("Feedback", back_populates="result")
 
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), index=True, nullable=False)
+    status = Column(String, default="queued") # queued, running, completed, failed
+    stage = Column(String) # human readable step, e.g. "Condensing organizations"
+    progress = Column(Integer, default=0) # percent
+    constraints = Column(JSON)
+    dedup_key = Column(String(64), nullable=False) # fingerprint of the analysis inputs
+    result_id = Column(Integer, ForeignKey("analysis_results.id"), nullable=True)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    result = relationship("AnalysisResult")
+
+    # At most one active job per project and input set; duplicate requests join it
+    __table_args__ = (
+        Index(
+            "uq_analysis_jobs_active", "project_id", "dedup_key", unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+            sqlite_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+
 class Feedback(Base):
     __tablename__ = "feedbacks"
     id = Column(Integer, primary_key=True, index=True)
@@ -103,3 +207,15 @@ class ChatMessage(Base):
     role = Column(String) # user, assistant
     content = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # History is paged newest-first per project
+    __table_args__ = (Index("ix_chat_messages_project_id_id", "project_id", "id"),)
+
+class ChatSummary(Base):
+    """Rolling summary of chat turns that no longer fit in the prompt window."""
+    __tablename__ = "chat_summaries"
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), unique=True, nullable=False)
+    summary = Column(Text, nullable=False)
+    summarized_through_id = Column(Integer, nullable=False) # last ChatMessage.id folded into the summary
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,179 @@
+"""
+In-process vector index for deployments without pgvector (plain Postgres or SQLite).
+
+Each project's vectors live in memory-mapped files under VECTOR_INDEX_DIR:
+
+- `project_<id>.vectors.npy`: float32 matrix, one row per chunk, with spare capacity
+  so appends rarely rewrite the file.
+- `project_<id>.rows.npy`: chunk id and squared norm of each row.
+- `project_<id>.json`: row count, highest chunk id and dimensions.
+
+The database stays the source of truth. Before a search the index appends chunks
+with ids above the highest one it holds, and is rebuilt when its row count then
+disagrees with the database (a transaction that committed an older id late, or
+changed dimensions). Searches are exact: L2 distances from block-wise matrix
+multiplies, reduced with argpartition, so memory stays bounded by the block size.
+Workers append after each document when they share VECTOR_INDEX_DIR with the API.
+"""
+from contextlib import contextmanager, nullcontext
+from sqlalchemy import func
+from app import models
+from app.openai_client import EMBEDDING_DIMENSIONS
+import json
+import os
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: processes do not share the lock, threads still do
+    fcntl = None
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(os.getcwd(), "data", "vector_index"))
+# Rows multiplied per step; bounds search memory to about block * queries floats
+NUMPY_SEARCH_BLOCK_ROWS = int(os.getenv("NUMPY_SEARCH_BLOCK_ROWS", "65536"))
+NUMPY_SYNC_BATCH_SIZE = int(os.getenv("NUMPY_SYNC_BATCH_SIZE", "2000"))
+# Workers append finished documents; only useful when VECTOR_INDEX_DIR is shared with the API
+NUMPY_INDEX_SYNC_ON_INGEST = os.getenv("NUMPY_INDEX_SYNC_ON_INGEST", "true").lower() == "true"
+MIN_CAPACITY = 1024
+
+ROW_DTYPE = np.dtype([("id", "<i8"), ("sqnorm", "<f4")])
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _paths(project_id: int):
+    base = os.path.join(VECTOR_INDEX_DIR, f"project_{project_id}")
+    return f"{base}.vectors.npy", f"{base}.rows.npy", f"{base}.json", f"{base}.lock"
+
+@contextmanager
+def _locked(project_id: int, exclusive: bool):
+    """Serialize writers of a project's files across threads and, where flock exists, processes."""
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(project_id, threading.Lock())
+    os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+    with thread_lock if exclusive else nullcontext():
+        with open(_paths(project_id)[3], "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_header(project_id: int):
+    try:
+        with open(_paths(project_id)[2]) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_header(project_id: int, header: dict):
+    path = _paths(project_id)[2]
+    with open(path + ".tmp", "w") as f:
+        json.dump(header, f)
+    os.replace(path + ".tmp", path)
+
+def _ensure_capacity(project_id: int, count: int, needed: int, dim: int):
+    """Make both files hold at least `needed` rows, keeping the first `count`."""
+    vectors_path, rows_path, _, _ = _paths(project_id)
+    if os.path.exists(vectors_path):
+        capacity = np.load(vectors_path, mmap_mode="r").shape
+        if capacity[0] >= needed and capacity[1] == dim:
+            return
+    capacity = max(needed, 2 * count, MIN_CAPACITY)
+    for path, shape, dtype in ((vectors_path, (capacity, dim), np.float32), (rows_path, (capacity,), ROW_DTYPE)):
+        grown = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=dtype, shape=shape)
+        if count:
+            grown[:count] = np.load(path, mmap_mode="r")[:count]
+        grown.flush()
+        del grown
+        os.replace(path + ".tmp", path)
+
+def _append(project_id: int, header: dict, ids, vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count, n = header["count"], len(ids)
+    _ensure_capacity(project_id, count, count + n, header["dim"])
+    vectors_path, rows_path, _, _ = _paths(project_id)
+    stored = np.load(vectors_path, mmap_mode="r+")
+    stored[count:count + n] = vectors
+    stored.flush()
+    rows = np.load(rows_path, mmap_mode="r+")
+    rows["id"][count:count + n] = ids
+    rows["sqnorm"][count:count + n] = np.einsum("ij,ij->i", vectors, vectors)
+    rows.flush()
+    del stored, rows
+    header.update(count=count + n, max_id=int(ids[-1]))
+    _write_header(project_id, header)
+
+def _embedded_chunks(db, project_id: int):
+    Chunk = models.ExtractedChunk
+    return db.query(Chunk).filter(Chunk.project_id == project_id, Chunk.embedding.isnot(None))
+
+def _load_range(db, project_id: int, header: dict, after_id: int, last_id: int):
+    Chunk = models.ExtractedChunk
+    while True:
+        batch = _embedded_chunks(db, project_id).with_entities(Chunk.id, Chunk.embedding).filter(
+            Chunk.id > after_id, Chunk.id <= last_id
+        ).order_by(Chunk.id).limit(NUMPY_SYNC_BATCH_SIZE).all()
+        if not batch:
+            return
+        _append(project_id, header, [row.id for row in batch], np.stack([row.embedding for row in batch]))
+        after_id = batch[-1].id
+
+def sync_project(db, project_id: int) -> int:
+    """Bring a project's index up to date with the database; returns its row count."""
+    Chunk = models.ExtractedChunk
+    db_count, db_max_id = _embedded_chunks(db, project_id).with_entities(func.count(Chunk.id), func.max(Chunk.id)).one()
+    db_max_id = db_max_id or 0
+    with _locked(project_id, exclusive=True):
+        header = _read_header(project_id)
+        if header and header["dim"] == EMBEDDING_DIMENSIONS and header["count"] == db_count and header["max_id"] == db_max_id:
+            return db_count
+        for attempt in ("append", "rebuild"):
+            if attempt == "rebuild" or not header or header["dim"] != EMBEDDING_DIMENSIONS or header["max_id"] > db_max_id:
+                header = {"count": 0, "max_id": 0, "dim": EMBEDDING_DIMENSIONS}
+                _write_header(project_id, header)
+            # Only up to the id counted above, so rows inserted meanwhile do not skew the comparison
+            _load_range(db, project_id, header, header["max_id"], db_max_id)
+            if header["count"] == db_count:
+                break
+            print(f"Vector index for project {project_id} is out of step with the database, rebuilding")
+        return header["count"]
+
+def search(db, project_id: int, query_embeddings, k: int):
+    """Exact k nearest chunks by L2 distance for each query vector.
+
+    Returns one list of (chunk_id, distance) pairs per query, nearest first.
+    """
+    queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+    sync_project(db, project_id)
+    with _locked(project_id, exclusive=False):
+        header = _read_header(project_id)
+        count = header["count"] if header else 0
+        if not count:
+            return [[] for _ in queries]
+        vectors_path, rows_path, _, _ = _paths(project_id)
+        vectors = np.load(vectors_path, mmap_mode="r")
+        rows = np.load(rows_path, mmap_mode="r")
+        k = min(k, count)
+        best_dist = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, count, NUMPY_SEARCH_BLOCK_ROWS):
+            stop = min(start + NUMPY_SEARCH_BLOCK_ROWS, count)
+            # |v - q|^2 without the |q|^2 term, which is the same for every row
+            dist = rows["sqnorm"][start:stop] - 2 * (queries @ vectors[start:stop].T)
+            idx = np.broadcast_to(np.arange(start, stop), dist.shape)
+            dist = np.concatenate([best_dist, dist], axis=1)
+            idx = np.concatenate([best_idx, idx], axis=1)
+            if dist.shape[1] > k:
+                keep = np.argpartition(dist, k - 1, axis=1)[:, :k]
+                dist, idx = np.take_along_axis(dist, keep, axis=1), np.take_along_axis(idx, keep, axis=1)
+            best_dist, best_idx = dist, idx
+        order = np.argsort(best_dist, axis=1)
+        best_dist, best_idx = np.take_along_axis(best_dist, order, axis=1), np.take_along_axis(best_idx, order, axis=1)
+        query_sqnorms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        distances = np.sqrt(np.maximum(best_dist + query_sqnorms, 0))
+        ids = rows["id"][best_idx]
+        return [list(zip(map(int, i), map(float, d))) for i, d in zip(ids, distances)]
@@ -1,25 +1,51 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# text-embedding-3 models can return shortened vectors (e.g. 512); changing this
+# requires re-embedding stored chunks with scripts.migrate_embeddings
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+
+def embedding_options():
+    """Extra embeddings.create arguments; only text-embedding-3 models accept `dimensions`."""
+    if EMBEDDING_MODEL.startswith("text-embedding-3"):
+        return {"dimensions": EMBEDDING_DIMENSIONS}
+    return {}
+
 # Lazy client initialization - only create when actually needed
 _client_instance = None
+_async_client_instance = None
+
+def _get_api_key():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    return api_key
 
 def get_openai_client():
     """Factory function to get OpenAI client. Creates it lazily on first call."""
     global _client_instance
     if _client_instance is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-        _client_instance = OpenAI(api_key=api_key)
+        _client_instance = OpenAI(api_key=_get_api_key())
     return _client_instance
 
+def get_async_openai_client():
+    """Factory for the AsyncOpenAI client used by request handlers that must not block the event loop."""
+    global _async_client_instance
+    if _async_client_instance is None:
+        _async_client_instance = AsyncOpenAI(api_key=_get_api_key())
+    return _async_client_instance
+
 # For backward compatibility, create a property-like access
 class _ClientProxy:
+    def __init__(self, factory):
+        self._factory = factory
+
     def __getattr__(self, name):
-        return getattr(get_openai_client(), name)
+        return getattr(self._factory(), name)
 
-openai_client = _ClientProxy()
+openai_client = _ClientProxy(get_openai_client)
+async_openai_client = _ClientProxy(get_async_openai_client)
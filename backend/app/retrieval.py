@@ -0,0 +1,99 @@
+from sqlalchemy.orm import Session
+from app import models, vector_index
+from app.database import RETRIEVAL_BACKEND
+from common.tokens import count_tokens
+import numpy as np
+import os
+
+# Nearest chunks fetched before maximal-marginal-relevance re-ranking
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "50"))
+# 1.0 ranks by relevance only; lower values favour chunks unlike those already picked
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Candidates at least this cosine-similar to a picked chunk are dropped, not just demoted
+RETRIEVAL_REDUNDANCY_THRESHOLD = float(os.getenv("RETRIEVAL_REDUNDANCY_THRESHOLD", "0.95"))
+# Most chunks from any one organization per answer; 0 for no quota
+RETRIEVAL_MAX_PER_ORGANIZATION = int(os.getenv("RETRIEVAL_MAX_PER_ORGANIZATION", "0"))
+
+def search_chunks(db: Session, project_id: int, query_embedding, limit: int = 5):
+    """Return the project's chunks nearest to the query embedding.
+
+    Filters on the denormalized ExtractedChunk.project_id so the ANN index can be
+    used directly, without joining through uploads. Near-duplicates have no embedding
+    and are skipped, so they cannot crowd out distinct results. The ordering follows
+    VECTOR_STORAGE, so results come from whichever index is configured. With the
+    numpy backend the project's in-process index picks the ids instead.
+    """
+    if RETRIEVAL_BACKEND == "numpy":
+        return _search_numpy(db, project_id, query_embedding, limit)
+    vector_index.apply_search_settings(db, vector_index.index_candidates(limit))
+    query = db.query(models.ExtractedChunk).filter(
+        models.ExtractedChunk.project_id == project_id,
+        models.ExtractedChunk.duplicate_of_id.is_(None),
+    )
+    return vector_index.order_by_distance(query, query_embedding, limit).all()
+
+def _search_numpy(db: Session, project_id: int, query_embedding, limit: int):
+    from app import numpy_index
+
+    ids = [chunk_id for chunk_id, _ in numpy_index.search(db, project_id, query_embedding, limit)[0]]
+    if not ids:
+        return []
+    chunks = {c.id: c for c in db.query(models.ExtractedChunk).filter(models.ExtractedChunk.id.in_(ids)).all()}
+    return [chunks[i] for i in ids if i in chunks]
+
+def _unit_rows(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def mmr_rerank(
+    chunks,
+    query_embedding,
+    limit: int,
+    max_tokens: int = None,
+    token_cost=count_tokens,
+    lambda_mult: float = MMR_LAMBDA,
+    max_per_organization: int = RETRIEVAL_MAX_PER_ORGANIZATION,
+):
+    """Pick up to limit chunks by maximal marginal relevance, in the order picked.
+
+    Each step takes the candidate maximizing lambda * sim(query) - (1 - lambda) *
+    max sim(picked), all cosine similarities from one matrix product. Candidates
+    nearly identical to a pick, over their organization's quota, or too large for
+    the remaining token budget (token_cost of their content) are ruled out, so
+    fewer than limit chunks can come back.
+    """
+    if not chunks:
+        return []
+    vectors = _unit_rows([c.embedding for c in chunks])
+    relevance = vectors @ _unit_rows(query_embedding)[0]
+    similarity = vectors @ vectors.T
+    redundancy = np.zeros(len(chunks), dtype=np.float32)
+    available = np.ones(len(chunks), dtype=bool)
+    organizations = np.array([c.organization_id or 0 for c in chunks])
+    costs = np.array([token_cost(c.content) for c in chunks]) if max_tokens else None
+    budget, per_organization, picked = max_tokens, {}, []
+    while len(picked) < limit:
+        if costs is not None:
+            available &= costs <= budget
+        if not available.any():
+            break
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        pick = int(np.argmax(scores))
+        picked.append(pick)
+        available[pick] = False
+        available &= similarity[pick] < RETRIEVAL_REDUNDANCY_THRESHOLD
+        redundancy = np.maximum(redundancy, similarity[pick])
+        if costs is not None:
+            budget -= costs[pick]
+        if max_per_organization:
+            organization = organizations[pick]
+            per_organization[organization] = per_organization.get(organization, 0) + 1
+            if per_organization[organization] >= max_per_organization:
+                available &= organizations != organization
+    return [chunks[i] for i in picked]
+
+def search_diverse(db: Session, project_id: int, query_embedding, limit: int = 5, max_tokens: int = None, token_cost=count_tokens):
+    """Nearest RETRIEVAL_CANDIDATES chunks, re-ranked with `mmr_rerank` down to at most limit."""
+    candidates = search_chunks(db, project_id, query_embedding, limit=max(RETRIEVAL_CANDIDATES, limit))
+    return mmr_rerank(candidates, query_embedding, limit, max_tokens=max_tokens, token_cost=token_cost)
@@ -82,6 +82,7 @@ class UploadBase(BaseModel):
 class Upload(UploadBase):
     id: int
     status: str
+    content_hash: Optional[str] = None
     s3_key: str
     project_id: int
     organization_id: Optional[int]
@@ -100,3 +101,18 @@ class AnalysisResult(AnalysisResultBase):
     created_at: datetime
     class Config:
         from_attributes = True
+
+class AnalysisJob(BaseModel):
+    id: int
+    project_id: int
+    status: str
+    stage: Optional[str] = None
+    progress: int
+    constraints: Optional[Any] = None
+    result_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    result: Optional[AnalysisResult] = None
+    class Config:
+        from_attributes = True
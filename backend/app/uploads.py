@@ -0,0 +1,95 @@
+from multipart.multipart import MultipartParser, parse_options_header
+import os
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Documents the raw multipart body for Swagger, since the endpoint reads the stream itself
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+class MultipartFileReceiver:
+    """Incrementally parse a multipart/form-data body and collect the bytes of one file field.
+
+    Feed it request body chunks as they arrive; `take()` hands over the file bytes
+    received so far. Nothing is spooled to memory or disk beyond what the caller
+    has not yet taken.
+    """
+
+    def __init__(self, content_type_header: str, field_name: str = "file"):
+        content_type, params = parse_options_header(content_type_header)
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise ValueError("Expected a multipart/form-data body")
+        self.field_name = field_name.encode()
+        self.filename = None
+        self.content_type = None
+        self.finished = False
+        self._pending = bytearray()
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._parser = MultipartParser(params[b"boundary"], callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._pending)
+
+    def feed(self, chunk: bytes):
+        self._parser.write(chunk)
+
+    def take(self) -> bytes:
+        data = bytes(self._pending)
+        self._pending.clear()
+        return data
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._in_file = False
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        # Only the first file in the target field is kept
+        if options.get(b"name") == self.field_name and b"filename" in options and self.filename is None:
+            self._in_file = True
+            self.filename = os.path.basename(options[b"filename"].decode("utf-8", "replace"))
+            self.content_type = self._headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+
+    def _on_part_data(self, data, start, end):
+        if self._in_file:
+            self._pending += data[start:end]
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self.finished = True
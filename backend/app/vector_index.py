@@ -0,0 +1,200 @@
+"""
+Management of the approximate nearest-neighbour index on extracted_chunks.embedding,
+used when RETRIEVAL_BACKEND is pgvector (see app.numpy_index for the alternative).
+
+The operator class must match the distance used at query time: retrieval orders by
+`l2_distance` (`<->`), so the index is built with `vector_l2_ops`.
+
+The column always holds full-precision vectors; VECTOR_STORAGE only changes what
+the index stores, which is what has to fit in memory:
+
+- `vector`: the vectors themselves (4 bytes per dimension).
+- `halfvec`: an expression index on `embedding::halfvec(N)` (2 bytes per dimension).
+  Queries order by the same expression so the planner can use it.
+- `binary`: an expression index on `binary_quantize(embedding)::bit(N)` (1 bit per
+  dimension) searched by Hamming distance. VECTOR_RERANK_FACTOR times as many
+  candidates as requested are re-ranked by exact L2 distance on the column.
+
+Both quantized modes need pgvector >= 0.7 in the database.
+"""
+from sqlalchemy import Float, cast, func, literal, select, text
+from sqlalchemy.dialects.postgresql import BIT
+from sqlalchemy.types import UserDefinedType
+from pgvector.sqlalchemy import Vector
+from app import models
+from app.database import RETRIEVAL_BACKEND
+from app.openai_client import EMBEDDING_DIMENSIONS
+import os
+
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()  # hnsw, ivfflat or none
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "vector").lower()  # vector, halfvec or binary
+# Binary search fetches limit * this many candidates for exact re-ranking
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "10"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "100"))
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+# The project filter applies to rows the index returns, so small projects can come back
+# short. pgvector >= 0.8 can keep scanning until enough rows pass: "auto" enables
+# relaxed_order there; "off", relaxed_order or strict_order force a setting
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "auto").lower()
+# hnsw.ef_search upper limit in pgvector
+HNSW_EF_SEARCH_MAX = 1000
+
+STORAGE_MODES = ("vector", "halfvec", "binary")
+QUANTIZED_MIN_VERSION = (0, 7)
+
+# (index type, storage) -> name; plain vector indexes keep their original names
+INDEX_NAMES = {
+    (index_type, storage): f"ix_extracted_chunks_embedding_{'' if storage == 'vector' else storage + '_'}{index_type}"
+    for index_type in ("hnsw", "ivfflat")
+    for storage in STORAGE_MODES
+}
+
+class HalfVec(UserDefinedType):
+    """pgvector's halfvec type, for casts in index expressions and queries."""
+    cache_ok = True
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def get_col_spec(self, **kw):
+        return f"HALFVEC({self.dim})"
+
+def _index_expression(storage: str, dim: int = EMBEDDING_DIMENSIONS) -> str:
+    if storage == "halfvec":
+        return f"(embedding::halfvec({dim})) halfvec_l2_ops"
+    if storage == "binary":
+        return f"(binary_quantize(embedding)::bit({dim})) bit_hamming_ops"
+    return "embedding vector_l2_ops"
+
+def index_definition(index_type: str = VECTOR_INDEX_TYPE, storage: str = VECTOR_STORAGE) -> str:
+    name = INDEX_NAMES[(index_type, storage)]
+    if index_type == "hnsw":
+        params = f"m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}"
+    else:
+        params = f"lists = {IVFFLAT_LISTS}"
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON extracted_chunks "
+        f"USING {index_type} ({_index_expression(storage)}) WITH ({params})"
+    )
+
+def _index_is_valid(conn, name: str):
+    """Return True/False for an existing index on extracted_chunks, or None if it does not exist.
+
+    Only indexes of the extracted_chunks found on the search path count, so a
+    same-named index in another schema is never reported (or dropped).
+    """
+    return conn.execute(text("""
+        SELECT i.indisvalid FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name AND i.indrelid = to_regclass('extracted_chunks')
+    """), {"name": name}).scalar()
+
+def extension_version(conn):
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return tuple(int(part) for part in version.split(".")[:2]) if version else None
+
+def column_type(conn) -> str:
+    """Declared type of extracted_chunks.embedding, e.g. 'vector(1536)'."""
+    return conn.execute(text("""
+        SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = 'extracted_chunks'::regclass AND attname = 'embedding' AND NOT attisdropped
+    """)).scalar()
+
+def ensure_vector_index(engine):
+    """Create the configured ANN index without blocking writes and drop the other kinds.
+
+    An interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index behind, which
+    IF NOT EXISTS would silently accept, so invalid indexes are dropped and rebuilt.
+    Nothing is changed while the column's dimensions differ from EMBEDDING_DIMENSIONS;
+    `scripts.migrate_embeddings` re-embeds the rows first.
+    """
+    if engine.dialect.name != "postgresql" or RETRIEVAL_BACKEND != "pgvector":
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(text("SELECT to_regclass('extracted_chunks') IS NOT NULL")).scalar():
+            return
+        declared = column_type(conn)
+        if declared != f"vector({EMBEDDING_DIMENSIONS})":
+            print(f"⚠ extracted_chunks.embedding is {declared}, expected vector({EMBEDDING_DIMENSIONS}); "
+                  "run `python -m scripts.migrate_embeddings` before changing EMBEDDING_DIMENSIONS")
+            return
+        if VECTOR_STORAGE != "vector" and (extension_version(conn) or (0, 0)) < QUANTIZED_MIN_VERSION:
+            print(f"⚠ VECTOR_STORAGE={VECTOR_STORAGE} needs pgvector >= 0.7; run ALTER EXTENSION vector UPDATE")
+            return
+        wanted = INDEX_NAMES.get((VECTOR_INDEX_TYPE, VECTOR_STORAGE))
+        for name in INDEX_NAMES.values():
+            valid = _index_is_valid(conn, name)
+            if valid is None:
+                continue
+            if name != wanted or not valid:
+                print(f"Dropping vector index {name}")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        if wanted:
+            print(f"Ensuring {VECTOR_INDEX_TYPE} vector index on {VECTOR_STORAGE} storage (this may take a while on large tables)...")
+            conn.execute(text(index_definition()))
+            print("✓ Vector index ready")
+
+_server_iterative_scan = None
+
+def _iterative_scan(db) -> str:
+    """The iterative scan mode to use, checking the server's pgvector version once per process."""
+    global _server_iterative_scan
+    if VECTOR_ITERATIVE_SCAN != "auto":
+        return "" if VECTOR_ITERATIVE_SCAN == "off" else VECTOR_ITERATIVE_SCAN
+    if _server_iterative_scan is None:
+        version = extension_version(db.connection())
+        _server_iterative_scan = "relaxed_order" if version and version >= (0, 8) else ""
+    return _server_iterative_scan
+
+def index_candidates(limit: int, storage: str = VECTOR_STORAGE) -> int:
+    """Rows the index has to produce for a search returning limit rows."""
+    return limit * VECTOR_RERANK_FACTOR if storage == "binary" else limit
+
+def apply_search_settings(db, candidates: int = 0):
+    """Set per-transaction recall/speed knobs before a vector search needing `candidates` index rows.
+
+    An HNSW scan yields at most ef_search rows before the project filter, so
+    ef_search is raised to the candidate count. With an iterative scan the index
+    keeps going until enough rows pass the filter; without one (pgvector < 0.8) a
+    project holding a small share of the table can still get fewer rows.
+    """
+    if db.get_bind().dialect.name != "postgresql" or RETRIEVAL_BACKEND != "pgvector":
+        return
+    iterative = _iterative_scan(db)
+    if VECTOR_INDEX_TYPE == "hnsw":
+        ef_search = min(max(HNSW_EF_SEARCH, candidates), HNSW_EF_SEARCH_MAX)
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {ef_search}"))
+        if iterative:
+            db.execute(text(f"SET LOCAL hnsw.iterative_scan = {iterative}"))
+    elif VECTOR_INDEX_TYPE == "ivfflat":
+        db.execute(text(f"SET LOCAL ivfflat.probes = {IVFFLAT_PROBES}"))
+        if iterative:
+            # ivfflat only supports relaxed_order
+            db.execute(text("SET LOCAL ivfflat.iterative_scan = relaxed_order"))
+
+def order_by_distance(query, query_embedding, limit: int, storage: str = VECTOR_STORAGE):
+    """Order an ExtractedChunk query by distance to query_embedding and limit it.
+
+    The ordering expression matches the index built for storage, so the same query
+    can use it. With binary storage the index only picks limit * VECTOR_RERANK_FACTOR
+    candidates, which are then ranked by exact L2 distance on the full vectors.
+    """
+    Chunk = models.ExtractedChunk
+    dim = EMBEDDING_DIMENSIONS
+    # Typed, so overloaded functions such as binary_quantize resolve
+    query_vector = cast(literal(list(query_embedding), Vector(dim)), Vector(dim))
+    exact = Chunk.embedding.l2_distance(query_vector)
+    if storage == "halfvec":
+        return query.order_by(
+            cast(Chunk.embedding, HalfVec(dim)).op("<->", return_type=Float)(cast(query_vector, HalfVec(dim)))
+        ).limit(limit)
+    if storage == "binary":
+        hamming = cast(func.binary_quantize(Chunk.embedding), BIT(dim)).op("<~>", return_type=Float)(
+            cast(func.binary_quantize(query_vector), BIT(dim))
+        )
+        candidates = query.with_entities(Chunk.id).order_by(hamming).limit(limit * VECTOR_RERANK_FACTOR).subquery()
+        return query.filter(Chunk.id.in_(select(candidates.c.id))).order_by(exact).limit(limit)
+    return query.order_by(exact).limit(limit)
@@ -0,0 +1,16 @@
+import redis
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Lazy client initialization - one connection pool per process
+_redis_client = None
+
+def get_redis_client():
+    """Get or create the shared Redis client used for caches (not the Celery broker)."""
+    global _redis_client
+    if _redis_client is None:
+        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        _redis_client = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+    return _redis_client
@@ -1,19 +1,76 @@
 import boto3
+import hashlib
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
 load_dotenv()
 
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "60"))
+# Where workers spool downloaded objects; defaults to the system temp dir
+WORKER_TMP_DIR = os.getenv("WORKER_TMP_DIR") or None
+# Downloads are streamed to disk in chunks of this size, one at a time
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+# Lazy client initialization - one client (and connection pool) per process
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def _reset_after_fork():
+    # Sockets and locks inherited from the parent must not be reused in a forked child
+    global _s3_client, _s3_client_lock
+    _s3_client = None
+    _s3_client_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_s3_client():
+    """Get or create the process-wide S3 client.
+
+    boto3 clients are thread-safe, so the API threadpool and Celery tasks share one
+    client and reuse its keep-alive connections instead of paying client construction
+    and new TCP/TLS handshakes on every request.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.session.Session().client(
+                    's3',
+                    endpoint_url=os.getenv("MINIO_URL"),
+                    aws_access_key_id=os.getenv("MINIO_ACCESS_KEY"),
+                    aws_secret_access_key=os.getenv("MINIO_SECRET_KEY"),
+                    region_name='us-east-1',
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"},
+                        connect_timeout=S3_CONNECT_TIMEOUT,
+                        read_timeout=S3_READ_TIMEOUT,
+                    ),
+                )
+    return _s3_client
+
+# S3 requires every part except the last to be at least 5 MiB
+UPLOAD_PART_SIZE = max(int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+# Buckets already verified by this process, so uploads don't pay a HEAD round trip each time
+_ready_buckets = set()
+_bucket_lock = threading.Lock()
+
+class UploadTooLargeError(Exception):
+    pass
+
 class S3Service:
     def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            endpoint_url=os.getenv("MINIO_URL"),
-            aws_access_key_id=os.getenv("MINIO_ACCESS_KEY"),
-            aws_secret_access_key=os.getenv("MINIO_SECRET_KEY"),
-            region_name='us-east-1'
-        )
+        self.s3_client = get_s3_client()
         self.bucket = os.getenv("MINIO_BUCKET_NAME")
 
     def upload_file(self, file_path, object_name=None):
@@ -35,6 +92,36 @@ class S3Service:
             return False
         return True
 
+    @contextmanager
+    def download_to_tempfile(self, object_name, suffix=""):
+        """Stream an object into a temporary file and yield its path; the file is removed afterwards.
+
+        Memory use stays at one chunk regardless of object size, and extractors can
+        open the file by path (PyMuPDF, openpyxl and PIL read it lazily from disk).
+        """
+        config = TransferConfig(multipart_chunksize=DOWNLOAD_CHUNK_SIZE, max_concurrency=1, use_threads=False)
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=WORKER_TMP_DIR)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                self.s3_client.download_fileobj(self.bucket, object_name, f, Config=config)
+            yield path
+        finally:
+            os.remove(path)
+
+    def delete_objects(self, object_names):
+        """Delete objects by key, up to 1000 per request; missing keys are not an error."""
+        object_names = list(object_names)
+        for start in range(0, len(object_names), 1000):
+            self.s3_client.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": name} for name in object_names[start:start + 1000]], "Quiet": True,
+            })
+
+    def delete_prefix(self, prefix):
+        """Delete every object whose key starts with prefix."""
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            self.delete_objects(item["Key"] for item in page.get("Contents", []))
+
     def get_download_url(self, object_name, expiration=3600):
         try:
             response = self.s3_client.generate_presigned_url(
@@ -52,3 +139,83 @@ class S3Service:
             self.s3_client.head_bucket(Bucket=self.bucket)
         except ClientError:
             self.s3_client.create_bucket(Bucket=self.bucket)
+
+    def ensure_bucket(self):
+        """Create the bucket if needed, checking at most once per process."""
+        if self.bucket in _ready_buckets:
+            return
+        with _bucket_lock:
+            if self.bucket not in _ready_buckets:
+                self.create_bucket_if_not_exists()
+                _ready_buckets.add(self.bucket)
+
+    def open_stream_writer(self, object_name, content_type=None, max_bytes=None):
+        return S3StreamWriter(self, object_name, content_type=content_type, max_bytes=max_bytes)
+
+class S3StreamWriter:
+    """Upload a byte stream to S3 in fixed-size parts while counting and hashing it.
+
+    At most one part is buffered in memory. Objects smaller than one part are sent
+    with a single put_object; larger ones use a multipart upload that is aborted if
+    anything goes wrong, so no orphaned parts are left behind.
+    """
+
+    def __init__(self, s3_service, object_name, content_type=None, max_bytes=None, part_size=UPLOAD_PART_SIZE):
+        self.s3 = s3_service
+        self.object_name = object_name
+        self.content_type = content_type
+        self.max_bytes = max_bytes
+        self.part_size = part_size
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {self.max_bytes} byte limit")
+        self._sha256.update(data)
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._upload_part(part)
+
+    def _upload_part(self, body: bytes):
+        client, bucket = self.s3.s3_client, self.s3.bucket
+        if self._upload_id is None:
+            extra = {"ContentType": self.content_type} if self.content_type else {}
+            self._upload_id = client.create_multipart_upload(Bucket=bucket, Key=self.object_name, **extra)["UploadId"]
+        part_number = len(self._parts) + 1
+        response = client.upload_part(
+            Bucket=bucket, Key=self.object_name, UploadId=self._upload_id, PartNumber=part_number, Body=body
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def close(self):
+        """Flush the remaining bytes and finalize the object."""
+        client, bucket = self.s3.s3_client, self.s3.bucket
+        if self._upload_id is None:
+            extra = {"ContentType": self.content_type} if self.content_type else {}
+            client.put_object(Bucket=bucket, Key=self.object_name, Body=bytes(self._buffer), **extra)
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            client.complete_multipart_upload(
+                Bucket=bucket, Key=self.object_name, UploadId=self._upload_id, MultipartUpload={"Parts": self._parts}
+            )
+        self._buffer = bytearray()
+
+    def abort(self):
+        if self._upload_id is not None:
+            try:
+                self.s3.s3_client.abort_multipart_upload(Bucket=self.s3.bucket, Key=self.object_name, UploadId=self._upload_id)
+            except ClientError as e:
+                print(f"Error aborting multipart upload: {e}")
+            self._upload_id = None
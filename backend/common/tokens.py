@@ -0,0 +1,26 @@
+import tiktoken
+
+# Encoders are expensive to build, so keep one per model for the process lifetime
+_encodings = {}
+
+def get_encoding(model: str = "text-embedding-3-small"):
+    """Return the tiktoken encoding for a model, falling back to cl100k_base."""
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _encodings[model] = encoding
+    return encoding
+
+def count_tokens(text: str, model: str = "text-embedding-3-small") -> int:
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "text-embedding-3-small") -> str:
+    """Cut text down to at most max_tokens tokens."""
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -7,6 +7,8 @@ import os
 import sys
 from sqlalchemy import create_engine, text
 from app import models
+from app.migrations import apply_schema_upgrades, backfill_chunk_scope, backfill_near_duplicate_index
+from app.vector_index import ensure_vector_index
 
 def init_database():
     """Initialize database with vector extension and tables."""
@@ -39,6 +41,17 @@ def init_database():
         print(f"Warning: Could not create tables: {e}")
         print("This is normal if tables already exist")
     
+    try:
+        # Columns, backfill and the ANN index are all applied online (no table locks)
+        print("Applying schema upgrades...")
+        apply_schema_upgrades(engine)
+        backfill_chunk_scope(engine)
+        ensure_vector_index(engine)
+        backfill_near_duplicate_index(engine)
+        print("✓ Schema upgrades applied")
+    except Exception as e:
+        print(f"Warning: Could not apply schema upgrades: {e}")
+    
     print("\n✅ Database initialization complete!")
     print("The backend is ready to start.")
 
@@ -0,0 +1,92 @@
+"""
+Benchmark the built-in chunker against langchain's RecursiveCharacterTextSplitter.
+
+Two numbers are reported per splitter: splitting alone, and splitting plus the
+token counts that ingestion needs for embedding batching. The built-in chunker
+returns its counts with the chunks; langchain's chunks have to be encoded again.
+A tiktoken encode of the same input is the floor for any token-aware chunker and
+is reported alongside.
+
+Ingestion chunks one extracted unit (page, sheet, ...) at a time, so the input is
+cut into --unit-kb pieces first; --unit-kb 0 chunks it as a single text.
+
+Usage (from backend/):
+    python -m scripts.bench_chunker [--file document.txt] [--mb 20] [--unit-kb 3] [--repeat 3]
+
+langchain is no longer a dependency; install it separately to include the
+comparison (pip install langchain==0.1.1). Without --file a synthetic document
+of paragraphs, short lines and long sentences is generated.
+
+The output names the tokenizer used. The images bake in the real cl100k_base
+file, so run the script inside the worker image for numbers worth recording.
+"""
+import argparse
+import random
+import time
+
+from worker.chunking import split_text, split_text_with_counts, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from common.tokens import count_tokens, get_encoding
+
+WORDS = (
+    "pricing enterprise platform analytics competitor market revenue customers integration "
+    "security compliance roadmap onboarding support subscription annual discount feature"
+).split()
+
+def synthetic_text(megabytes: float, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    parts, size = [], 0
+    while size < megabytes * 1024 * 1024:
+        sentences = [" ".join(rng.choices(WORDS, k=rng.randint(6, 30))).capitalize() + "." for _ in range(rng.randint(1, 8))]
+        paragraph = " ".join(sentences)
+        if rng.random() < 0.2:
+            paragraph = "\n".join(f"- {s}" for s in sentences)
+        parts.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(parts)
+
+def bench(name, split, units, repeat):
+    best, chunks = None, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = [chunk for unit in units for chunk in split(unit)]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    megabytes = sum(len(unit.encode("utf-8")) for unit in units) / 1024 / 1024
+    chunks = [c if isinstance(c, str) else c[0] for c in chunks]
+    sizes = [count_tokens(c) for c in chunks[:2000]]
+    print(
+        f"{name:<36} {megabytes / best:8.2f} MB/s  {len(chunks):7d} chunks  "
+        f"tokens/chunk avg {sum(sizes) / max(len(sizes), 1):6.1f} max {max(sizes, default=0):5d}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="Text file to chunk instead of synthetic text")
+    parser.add_argument("--mb", type=float, default=20, help="Size of the synthetic document in MB")
+    parser.add_argument("--unit-kb", type=float, default=3, help="Size of the units chunked one at a time; 0 for one text")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per splitter; the best time is reported")
+    args = parser.parse_args()
+
+    text = open(args.file, encoding="utf-8").read() if args.file else synthetic_text(args.mb)
+    count_tokens("warm up")  # load the encoding outside the timed runs
+    list(split_text("warm up"))  # and build the chunker's token length table
+    unit_chars = int(args.unit_kb * 1024)
+    units = [text[i:i + unit_chars] for i in range(0, len(text), unit_chars)] if unit_chars else [text]
+    print(f"Input: {len(text.encode('utf-8')) / 1024 / 1024:.1f} MB in {len(units)} units, tokenizer {get_encoding().name}")
+
+    bench("tiktoken encode only", lambda t: [(t, len(get_encoding().encode_ordinary(t)))], units, args.repeat)
+    name = f"chunking {CHUNK_MAX_TOKENS}/{CHUNK_OVERLAP_TOKENS} tokens"
+    bench(name, split_text, units, args.repeat)
+    bench(name + " + counts", split_text_with_counts, units, args.repeat)
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    except ImportError:
+        print("langchain not installed, skipping RecursiveCharacterTextSplitter")
+        return
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    name = "langchain 1000/100 chars"
+    bench(name, splitter.split_text, units, args.repeat)
+    bench(name + " + counts", lambda t: [(c, count_tokens(c)) for c in splitter.split_text(t)], units, args.repeat)
+
+if __name__ == "__main__":
+    main()
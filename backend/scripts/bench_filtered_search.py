@@ -0,0 +1,109 @@
+"""
+Benchmark project-filtered vector search on a multi-project table.
+
+Builds a scratch copy of the schema in its own Postgres schema, fills
+extracted_chunks with random vectors spread over projects of very different
+sizes, builds the configured ANN index and runs `retrieval.search_chunks` for each
+project. Reported per project and iterative-scan setting: the average number of
+rows returned (out of the limit), recall against an exact scan, and p50 latency.
+The scratch schema is dropped afterwards.
+
+Usage (from backend/):
+    python -m scripts.bench_filtered_search [--rows 100000] [--limits 5,50] [--queries 20]
+
+Projects hold roughly 90%, 8%, 1.5% and 0.5% of the rows. The iterative settings
+compared are "off" and, on pgvector >= 0.8, "relaxed_order".
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import Session
+
+from app import models, retrieval, vector_index
+from app.database import SQLALCHEMY_DATABASE_URL, RETRIEVAL_BACKEND
+from app.openai_client import EMBEDDING_DIMENSIONS
+
+SCHEMA = "bench_filtered_search"
+PROJECT_SHARES = [0.9, 0.08, 0.015, 0.005]
+
+def populate(engine, rows: int, seed: int = 3):
+    models.Base.metadata.create_all(engine.execution_options(schema_translate_map={None: SCHEMA}))
+    rng = np.random.default_rng(seed)
+    with Session(engine) as db:
+        project_ids = []
+        for share in PROJECT_SHARES:
+            project = models.Project(name=f"bench {share:.1%}")
+            db.add(project)
+            db.flush()
+            project_ids.append(project.id)
+        assignments = rng.choice(project_ids, size=rows, p=PROJECT_SHARES)
+        for start in range(0, rows, 5000):
+            batch = assignments[start:start + 5000]
+            vectors = rng.standard_normal((len(batch), EMBEDDING_DIMENSIONS)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            db.execute(insert(models.ExtractedChunk), [
+                {"content": "", "embedding": vector, "project_id": int(project_id)}
+                for project_id, vector in zip(batch, vectors)
+            ])
+            db.commit()
+        return project_ids, rng
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="Chunks in the scratch table")
+    parser.add_argument("--limits", default="5,50", help="Comma-separated result counts (chat fetches 50 candidates)")
+    parser.add_argument("--queries", type=int, default=20, help="Random queries per project and setting")
+    args = parser.parse_args()
+    limits = [int(limit) for limit in args.limits.split(",")]
+
+    if not SQLALCHEMY_DATABASE_URL.startswith("postgres") or RETRIEVAL_BACKEND != "pgvector":
+        sys.exit("The filtered search benchmark needs PostgreSQL with the pgvector retrieval backend")
+    # Unqualified names, including those in vector_index's SQL, resolve to the scratch schema first
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"options": f"-csearch_path={SCHEMA},public"})
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        conn.commit()
+        version = vector_index.extension_version(conn)
+    try:
+        print(f"Loading {args.rows} vectors of {EMBEDDING_DIMENSIONS} dimensions...")
+        project_ids, rng = populate(engine, args.rows)
+        vector_index.ensure_vector_index(engine)
+        settings = ["off"] + (["relaxed_order"] if version and version >= (0, 8) else [])
+        print(f"pgvector {'.'.join(map(str, version or ()))}, {vector_index.VECTOR_INDEX_TYPE} index on "
+              f"{vector_index.VECTOR_STORAGE} storage, ef_search {vector_index.HNSW_EF_SEARCH}")
+        print(f"{'share':>6} {'limit':>5} {'iterative':<14} {'rows':>7} {'recall':>7} {'p50 ms':>8}")
+        queries = rng.standard_normal((args.queries, EMBEDDING_DIMENSIONS)).astype(np.float32)
+        with Session(engine) as db:
+            for share, project_id in zip(PROJECT_SHARES, project_ids):
+                for limit in limits:
+                    exact = []
+                    for query in queries:
+                        db.execute(text("SET LOCAL enable_indexscan = off"))
+                        exact.append({c.id for c in db.query(models.ExtractedChunk).filter(
+                            models.ExtractedChunk.project_id == project_id
+                        ).order_by(models.ExtractedChunk.embedding.l2_distance(query.tolist())).limit(limit)})
+                        db.rollback()
+                    for setting in settings:
+                        vector_index.VECTOR_ITERATIVE_SCAN = setting
+                        returned, recalls, latencies = [], [], []
+                        for query, expected in zip(queries, exact):
+                            start = time.perf_counter()
+                            found = retrieval.search_chunks(db, project_id, query.tolist(), limit)
+                            latencies.append((time.perf_counter() - start) * 1000)
+                            db.rollback()
+                            returned.append(len(found))
+                            recalls.append(len({c.id for c in found} & expected) / max(len(expected), 1))
+                        print(f"{share:6.1%} {limit:5d} {setting:<14} {statistics.mean(returned):7.1f} "
+                              f"{statistics.mean(recalls):7.3f} {statistics.median(latencies):8.2f}")
+    finally:
+        with engine.connect() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            conn.commit()
+
+if __name__ == "__main__":
+    main()
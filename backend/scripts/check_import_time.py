@@ -0,0 +1,76 @@
+"""
+Check cold import time of the API and worker entry points against a budget.
+
+Each target is imported in a fresh interpreter with `python -X importtime`; the
+best of several runs is compared with its budget, and the slowest modules are
+listed. The API must also not load any document extraction library.
+
+Usage (from backend/):
+    python -m scripts.check_import_time [--runs 3] [--top 10]
+
+Budgets are in milliseconds and can be overridden with IMPORT_BUDGET_API_MS and
+IMPORT_BUDGET_WORKER_MS. The defaults are about 1.5x the slowest of repeated
+measurements (API 1.5-1.9 s, worker 1.0-1.25 s), since cold imports vary by a
+quarter from run to run. Exits with status 1 if any check fails.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    "api": ("app.main", int(os.getenv("IMPORT_BUDGET_API_MS", "3000"))),
+    "worker": ("worker.tasks", int(os.getenv("IMPORT_BUDGET_WORKER_MS", "2000"))),
+}
+
+# The API only enqueues documents; none of these should be imported by it
+API_FORBIDDEN = ["fitz", "docx", "openpyxl", "pandas", "PIL", "pytesseract", "langchain"]
+
+def measure(module: str):
+    """Import module in a fresh interpreter; return {module: cumulative_us} for every import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        timings[name] = max(timings.get(name, 0), int(cumulative))
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per target; the fastest run counts")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list per target")
+    args = parser.parse_args()
+
+    failures = []
+    for label, (module, budget_ms) in TARGETS.items():
+        runs = [measure(module) for _ in range(args.runs)]
+        best = min(runs, key=lambda timings: timings[module])
+        total_ms = best[module] / 1000
+        verdict = "ok" if total_ms <= budget_ms else "OVER BUDGET"
+        print(f"{label}: import {module} took {total_ms:.0f} ms (budget {budget_ms} ms) {verdict}")
+        top_level = {name: us for name, us in best.items() if "." not in name and name != module}
+        for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {us / 1000:8.1f} ms  {name}")
+        if total_ms > budget_ms:
+            failures.append(f"{label} import time {total_ms:.0f} ms exceeds {budget_ms} ms")
+        if label == "api":
+            loaded = [name for name in API_FORBIDDEN if name in best]
+            if loaded:
+                failures.append(f"api imports extraction libraries: {', '.join(loaded)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
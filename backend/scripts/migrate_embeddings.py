@@ -0,0 +1,115 @@
+"""
+Re-embed stored chunks after changing EMBEDDING_DIMENSIONS.
+
+Run with the new settings in the environment while the deployed API and workers
+keep the old ones:
+
+    python -m scripts.migrate_embeddings            # backfill, can be re-run and resumed
+    python -m scripts.migrate_embeddings --swap     # stop workers first, then swap
+
+The backfill embeds every chunk that has a vector into a new `embedding_next`
+column in committed batches, going through the embedding cache. `--swap` runs a
+last backfill pass, then, under a short exclusive lock, drops the old column and
+renames the new one. Dropping the column drops its ANN index; the index for the
+configured VECTOR_STORAGE is then rebuilt concurrently. Deploy the new settings
+to the API and workers right after the swap.
+
+Near-duplicates have no vector and are left alone. Uploads recorded with the old
+pipeline version are moved to the new one so whole-file dedup keeps finding them.
+When only VECTOR_STORAGE changed nothing needs re-embedding; running this script
+(or restarting the API) rebuilds the index.
+"""
+import argparse
+import re
+import sys
+
+from sqlalchemy import text, update
+from sqlalchemy.orm import Session
+
+from app import models, vector_index
+from app.database import get_engine, RETRIEVAL_BACKEND
+from app.openai_client import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL
+from worker.embeddings import embed_texts
+
+TEMP_COLUMN = "embedding_next"
+
+def current_dimensions(conn):
+    match = re.fullmatch(r"vector\((\d+)\)", vector_index.column_type(conn) or "")
+    return int(match.group(1)) if match else None
+
+def backfill(engine, batch_size: int) -> int:
+    """Embed chunks missing from the new column, one committed batch at a time."""
+    total = 0
+    with Session(engine) as db:
+        while True:
+            rows = db.execute(text(f"""
+                SELECT id, content FROM extracted_chunks
+                WHERE embedding IS NOT NULL AND {TEMP_COLUMN} IS NULL
+                ORDER BY id LIMIT :limit
+            """), {"limit": batch_size}).all()
+            if not rows:
+                break
+            vectors = embed_texts([row.content for row in rows])
+            db.execute(
+                text(f"UPDATE extracted_chunks SET {TEMP_COLUMN} = CAST(:vector AS vector({EMBEDDING_DIMENSIONS})) WHERE id = :id"),
+                [{"id": row.id, "vector": str(list(vector))} for row, vector in zip(rows, vectors)],
+            )
+            db.commit()
+            total += len(rows)
+            print(f"  re-embedded {total} chunks (last id {rows[-1].id})")
+    return total
+
+def swap(engine, old_dimensions: int) -> bool:
+    """Replace the old column with the backfilled one; False if rows are still missing."""
+    from worker.tasks import PIPELINE_VERSION
+
+    with Session(engine) as db:
+        db.execute(text("LOCK TABLE extracted_chunks IN ACCESS EXCLUSIVE MODE"))
+        missing = db.execute(text(
+            f"SELECT count(*) FROM extracted_chunks WHERE embedding IS NOT NULL AND {TEMP_COLUMN} IS NULL"
+        )).scalar()
+        if missing:
+            db.rollback()
+            print(f"{missing} chunks were written during the last pass; stop the workers and run --swap again")
+            return False
+        db.execute(text("ALTER TABLE extracted_chunks DROP COLUMN embedding"))
+        db.execute(text(f"ALTER TABLE extracted_chunks RENAME COLUMN {TEMP_COLUMN} TO embedding"))
+        old_version = f"{PIPELINE_VERSION.rsplit(':', 1)[0]}:{old_dimensions}"
+        db.execute(
+            update(models.Upload).where(models.Upload.pipeline_version == old_version).values(pipeline_version=PIPELINE_VERSION)
+        )
+        db.commit()
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--swap", action="store_true", help="Finish the backfill and switch to the new column")
+    parser.add_argument("--batch-size", type=int, default=500, help="Chunks embedded per committed batch")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if engine.dialect.name != "postgresql" or RETRIEVAL_BACKEND != "pgvector":
+        sys.exit("Embedding migration needs PostgreSQL with the pgvector retrieval backend")
+    with engine.connect() as conn:
+        old_dimensions = current_dimensions(conn)
+        has_temp = conn.execute(text(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'extracted_chunks' AND column_name = :name"
+        ), {"name": TEMP_COLUMN}).scalar()
+
+    if old_dimensions == EMBEDDING_DIMENSIONS and not has_temp:
+        print(f"extracted_chunks.embedding is already vector({EMBEDDING_DIMENSIONS}); nothing to re-embed")
+    else:
+        print(f"Re-embedding chunks with {EMBEDDING_MODEL} at {EMBEDDING_DIMENSIONS} dimensions (column is vector({old_dimensions}))")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"ALTER TABLE extracted_chunks ADD COLUMN IF NOT EXISTS {TEMP_COLUMN} vector({EMBEDDING_DIMENSIONS})"))
+        print(f"✓ {backfill(engine, args.batch_size)} chunks re-embedded")
+        if not args.swap:
+            print("Run again with --swap once the workers are stopped")
+            return
+        if not swap(engine, old_dimensions):
+            sys.exit(1)
+        print(f"✓ extracted_chunks.embedding is now vector({EMBEDDING_DIMENSIONS})")
+    vector_index.ensure_vector_index(engine)
+
+if __name__ == "__main__":
+    main()
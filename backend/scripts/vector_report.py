@@ -0,0 +1,114 @@
+"""
+Compare recall and latency of the vector storage modes on real chunks.
+
+Stored chunk vectors of one project serve as queries. For each mode the report
+runs the same search retrieval uses (`vector_index.order_by_distance`) and
+compares its top k with the exact top k, found by a sequential scan. The query
+chunk itself is excluded from both.
+
+Usage (from backend/):
+    python -m scripts.vector_report [--project-id 1] [--queries 50] [--k 5]
+                                    [--modes vector,halfvec,binary] [--build-indexes]
+
+Latency is only meaningful for modes whose index exists; the others fall back to
+a sequential scan and are marked as such. --build-indexes creates the missing
+indexes concurrently for the comparison. The API drops indexes that do not
+match VECTOR_STORAGE on its next start.
+"""
+import argparse
+import statistics
+import sys
+import time
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from app import models, vector_index
+from app.database import get_engine, RETRIEVAL_BACKEND
+from app.openai_client import EMBEDDING_DIMENSIONS
+
+def bytes_per_vector(mode: str, dim: int = EMBEDDING_DIMENSIONS) -> int:
+    """Size of one indexed value, before the index's own per-tuple overhead."""
+    return 8 + {"vector": 4 * dim, "halfvec": 2 * dim, "binary": (dim + 7) // 8}[mode]
+
+def largest_project(db) -> int:
+    Chunk = models.ExtractedChunk
+    return db.query(Chunk.project_id).filter(Chunk.embedding.isnot(None)).group_by(
+        Chunk.project_id
+    ).order_by(func.count().desc()).limit(1).scalar()
+
+def search_ids(db, project_id, query_embedding, k, mode):
+    Chunk = models.ExtractedChunk
+    query = db.query(Chunk.id).filter(Chunk.project_id == project_id, Chunk.duplicate_of_id.is_(None))
+    return [row.id for row in vector_index.order_by_distance(query, query_embedding, k, mode)]
+
+def exact_ids(db, project_id, query_embedding, k):
+    db.execute(text("SET LOCAL enable_indexscan = off"))
+    db.execute(text("SET LOCAL enable_bitmapscan = off"))
+    ids = search_ids(db, project_id, query_embedding, k, "vector")
+    db.rollback()
+    return ids
+
+def index_status(conn, mode):
+    name = vector_index.INDEX_NAMES.get((vector_index.VECTOR_INDEX_TYPE, mode))
+    if not name or not vector_index._index_is_valid(conn, name):
+        return None, None
+    return name, conn.execute(text("SELECT pg_relation_size(to_regclass(:name))"), {"name": name}).scalar()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--project-id", type=int, help="Project to sample; defaults to the one with most vectors")
+    parser.add_argument("--queries", type=int, default=50, help="Chunk vectors used as queries")
+    parser.add_argument("--k", type=int, default=5, help="Results per search, as in chat retrieval")
+    parser.add_argument("--modes", default=",".join(vector_index.STORAGE_MODES), help="Comma-separated storage modes")
+    parser.add_argument("--build-indexes", action="store_true", help="Create missing indexes for the compared modes")
+    args = parser.parse_args()
+    modes = [m.strip() for m in args.modes.split(",") if m.strip() in vector_index.STORAGE_MODES]
+
+    engine = get_engine()
+    if engine.dialect.name != "postgresql" or RETRIEVAL_BACKEND != "pgvector":
+        sys.exit("The vector report needs PostgreSQL with the pgvector retrieval backend")
+    if args.build_indexes and vector_index.VECTOR_INDEX_TYPE in ("hnsw", "ivfflat"):
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for mode in modes:
+                print(f"Ensuring {vector_index.VECTOR_INDEX_TYPE} index for {mode} storage...")
+                conn.execute(text(vector_index.index_definition(storage=mode)))
+
+    Chunk = models.ExtractedChunk
+    with Session(engine) as db:
+        project_id = args.project_id or largest_project(db)
+        samples = db.query(Chunk.id, Chunk.embedding).filter(
+            Chunk.project_id == project_id, Chunk.embedding.isnot(None)
+        ).order_by(func.random()).limit(args.queries).all()
+        if not samples:
+            sys.exit(f"Project {project_id} has no embedded chunks")
+        print(f"Project {project_id}: {len(samples)} queries, k={args.k}, {EMBEDDING_DIMENSIONS} dimensions, "
+              f"{vector_index.VECTOR_INDEX_TYPE} index, rerank factor {vector_index.VECTOR_RERANK_FACTOR}")
+
+        truth = {chunk_id: [i for i in exact_ids(db, project_id, vector, args.k + 1) if i != chunk_id][:args.k]
+                 for chunk_id, vector in samples}
+
+        print(f"{'mode':<8} {'index':<44} {'size MB':>8} {'B/vector':>9} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+        for mode in modes:
+            with engine.connect() as conn:
+                name, size = index_status(conn, mode)
+            recalls, latencies = [], []
+            search_ids(db, project_id, samples[0].embedding, args.k + 1, mode)  # warm up
+            db.rollback()
+            for chunk_id, vector in samples:
+                vector_index.apply_search_settings(db, vector_index.index_candidates(args.k + 1, mode))
+                start = time.perf_counter()
+                found = search_ids(db, project_id, vector, args.k + 1, mode)
+                latencies.append((time.perf_counter() - start) * 1000)
+                db.rollback()
+                found = [i for i in found if i != chunk_id][:args.k]
+                expected = truth[chunk_id]
+                recalls.append(len(set(found) & set(expected)) / len(expected) if expected else 1.0)
+            p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+            print(
+                f"{mode:<8} {name or '(none: sequential scan)':<44} {(size or 0) / 1024 / 1024:8.1f} {bytes_per_vector(mode):9d} "
+                f"{statistics.mean(recalls):9.3f} {statistics.median(latencies):8.2f} {p95:8.2f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Cloning an upload's chunks into another project or organization.
+
+Run from backend/ with: python -m unittest discover tests
+Uses in-memory SQLite, so neither Postgres nor the OpenAI API is needed.
+"""
+import os
+import unittest
+
+# Before the app modules read it: SQLite stores vectors as bytes, not pgvector values
+os.environ["RETRIEVAL_BACKEND"] = "numpy"
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base
+from worker import near_duplicates, tasks
+
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho sigma tau".split()
+
+def text(seed, length=120):
+    return " ".join(WORDS[(seed * 7 + i * i) % len(WORDS)] for i in range(length))
+
+def edited(content):
+    words = content.split()
+    words[10] = "changed"
+    return " ".join(words)
+
+class CloneChunksTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        self.addCleanup(self.db.close)
+        embed_texts = tasks.embed_texts
+        tasks.embed_texts = lambda texts, counts=None: [[float(len(t) % 7)] * 4 for t in texts]
+        self.addCleanup(setattr, tasks, "embed_texts", embed_texts)
+
+        self.project = models.Project(name="p")
+        self.db.add(self.project)
+        self.db.flush()
+        self.org_a = models.Organization(name="A", project_id=self.project.id)
+        self.org_b = models.Organization(name="B", project_id=self.project.id)
+        self.db.add_all([self.org_a, self.org_b])
+        self.db.commit()
+
+    def add_upload(self, organization, chunks=(), **fields):
+        upload = models.Upload(
+            filename=f"{organization.name}.pdf", s3_key=f"{organization.name}-{len(chunks)}",
+            project_id=self.project.id, organization_id=organization.id, **fields,
+        )
+        self.db.add(upload)
+        self.db.commit()
+        if chunks:
+            tasks.store_chunks(self.db, upload, [(content, 10, {"page": i + 1}) for i, content in enumerate(chunks)])
+            upload.status = "completed"
+            self.db.commit()
+        return upload
+
+    def chunks(self, upload):
+        Chunk = models.ExtractedChunk
+        return self.db.query(Chunk).filter(Chunk.upload_id == upload.id).order_by(Chunk.id).all()
+
+    def test_cross_scope_clone_keeps_near_duplicates_linked(self):
+        source = self.add_upload(self.org_a, [text(1), text(2), edited(text(1)), text(3)])
+        originals = [c for c in self.chunks(source) if c.duplicate_of_id is None]
+        self.assertEqual(len(originals), 3)
+
+        copy = self.add_upload(self.org_b)
+        self.assertEqual(tasks.clone_chunks(self.db, copy, source), 4)
+
+        cloned = self.chunks(copy)
+        with_vectors = [c for c in cloned if c.embedding is not None]
+        duplicates = [c for c in cloned if c.embedding is None]
+        self.assertEqual(len(with_vectors), 3)
+        self.assertTrue(all(c.duplicate_of_id is None for c in with_vectors))
+        self.assertEqual(len(duplicates), 1)
+        target = self.db.get(models.ExtractedChunk, duplicates[0].duplicate_of_id)
+        self.assertEqual(target.upload_id, copy.id)
+        self.assertEqual(target.content, text(1))
+        self.assertEqual(duplicates[0].content, edited(text(1)))
+
+        # Only the copies with vectors join organization B's near-duplicate index
+        Band = models.ChunkLshBand
+        indexed = {chunk_id for (chunk_id,) in self.db.query(Band.chunk_id).filter(Band.organization_id == self.org_b.id)}
+        self.assertEqual(indexed, {c.id for c in with_vectors})
+        self.assertEqual(self.db.query(Band).filter(Band.organization_id == self.org_b.id).count(), 3 * near_duplicates.LSH_BANDS)
+
+    def test_cross_scope_clone_embeds_duplicates_of_other_uploads(self):
+        earlier = self.add_upload(self.org_a, [text(1)])
+        source = self.add_upload(self.org_a, [edited(text(1)), text(4)])
+        repeated = next(c for c in self.chunks(source) if c.content == edited(text(1)))
+        self.assertEqual(repeated.duplicate_of_id, self.chunks(earlier)[0].id)
+
+        copy = self.add_upload(self.org_b)
+        tasks.clone_chunks(self.db, copy, source)
+
+        # The chunk it repeated was not cloned, so the copy carries the original's vector itself
+        cloned = self.chunks(copy)
+        self.assertEqual(len(cloned), 2)
+        self.assertTrue(all(c.duplicate_of_id is None and c.embedding is not None for c in cloned))
+        copied = next(c for c in cloned if c.content == edited(text(1)))
+        self.assertEqual(list(copied.embedding), list(self.chunks(earlier)[0].embedding))
+
+    def test_same_scope_clone_links_to_source_chunks(self):
+        source = self.add_upload(self.org_a, [text(1), edited(text(1))])
+        copy = self.add_upload(self.org_a)
+        tasks.clone_chunks(self.db, copy, source)
+
+        originals = self.chunks(source)
+        self.assertEqual([c.duplicate_of_id for c in self.chunks(copy)], [originals[0].id, originals[0].id])
+        self.assertTrue(all(c.embedding is None for c in self.chunks(copy)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Ingest checkpoints: the compare-and-set cursor and resuming extraction after it.
+
+Run from backend/ with: python -m unittest discover tests
+Uses in-memory SQLite, so neither Postgres nor the OpenAI API is needed.
+"""
+import os
+import tempfile
+import unittest
+
+# Before the app modules read it: SQLite stores vectors as bytes, not pgvector values
+os.environ["RETRIEVAL_BACKEND"] = "numpy"
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import Base
+from worker import extraction, tasks
+
+class AdvanceCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        self.addCleanup(self.db.close)
+        embed_texts = tasks.embed_texts
+        tasks.embed_texts = lambda texts, counts=None: [[float(i)] * 4 for i, _ in enumerate(texts)]
+        self.addCleanup(setattr, tasks, "embed_texts", embed_texts)
+
+        project = models.Project(name="p")
+        self.db.add(project)
+        self.db.commit()
+        self.upload = models.Upload(filename="doc.pdf", s3_key="doc", project_id=project.id)
+        self.db.add(self.upload)
+        self.db.commit()
+        self.checkpoint = tasks.get_checkpoint(self.db, self.upload.id)
+
+    def store(self, *contents):
+        tasks.store_chunks(self.db, self.upload, [(content, 10, {"page": 1}) for content in contents])
+
+    def chunk_count(self):
+        return self.db.query(models.ExtractedChunk).filter(models.ExtractedChunk.upload_id == self.upload.id).count()
+
+    def test_advances_from_expected_cursor(self):
+        self.store("first unit", "second unit")
+        self.assertTrue(tasks.advance_checkpoint(self.db, self.checkpoint, 0, 2, 2))
+        self.assertTrue(tasks.advance_checkpoint(self.db, self.checkpoint, 2, 3, 0, completed=True))
+
+        self.db.refresh(self.checkpoint)
+        self.assertEqual((self.checkpoint.units_done, self.checkpoint.chunks_done), (3, 2))
+        self.assertTrue(self.checkpoint.completed)
+        self.assertEqual(self.chunk_count(), 2)
+
+    def test_stale_expected_cursor_does_not_advance(self):
+        # Another delivery committed the first four units
+        self.assertTrue(tasks.advance_checkpoint(self.db, self.checkpoint, 0, 4, 0))
+
+        # This delivery started from the old cursor; its chunks must not be kept twice
+        self.store("first unit", "second unit")
+        self.assertFalse(tasks.advance_checkpoint(self.db, self.checkpoint, 0, 2, 2))
+
+        self.db.refresh(self.checkpoint)
+        self.assertEqual((self.checkpoint.units_done, self.checkpoint.chunks_done), (4, 0))
+        self.assertFalse(self.checkpoint.completed)
+        self.assertEqual(self.chunk_count(), 0)
+
+    def test_completed_cursor_does_not_advance(self):
+        self.assertTrue(tasks.advance_checkpoint(self.db, self.checkpoint, 0, 2, 0, completed=True))
+        self.store("late unit")
+        self.assertFalse(tasks.advance_checkpoint(self.db, self.checkpoint, 2, 3, 1))
+
+        self.db.refresh(self.checkpoint)
+        self.assertEqual(self.checkpoint.units_done, 2)
+        self.assertEqual(self.chunk_count(), 0)
+
+class ResumeExtractionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        unit_chars = extraction.DOCX_UNIT_CHARS
+        extraction.DOCX_UNIT_CHARS = 60
+        self.addCleanup(setattr, extraction, "DOCX_UNIT_CHARS", unit_chars)
+
+    def assert_resumes(self, filename):
+        path = os.path.join(self.dir.name, filename)
+        units = list(extraction.iter_units(path, None, filename))
+        self.assertGreater(len(units), 3)
+        for skip in range(len(units) + 1):
+            self.assertEqual(list(extraction.iter_units(path, None, filename, skip_units=skip)), units[skip:])
+
+    def test_docx_resumes_after_skipped_units(self):
+        import docx
+        document = docx.Document()
+        for i in range(30):
+            document.add_paragraph(f"paragraph {i} " * (i % 4 + 1))
+        document.save(os.path.join(self.dir.name, "notes.docx"))
+        self.assert_resumes("notes.docx")
+
+    def test_xlsx_resumes_after_skipped_units(self):
+        import openpyxl
+        workbook = openpyxl.Workbook()
+        for row in range(200):
+            workbook.active.append([row, "value " * (row % 5)])
+        workbook.save(os.path.join(self.dir.name, "table.xlsx"))
+        self.assert_resumes("table.xlsx")
+
+    def test_processed_image_is_not_recognized_again(self):
+        self.assertEqual(list(extraction.iter_units("scan.png", None, "scan.png", skip_units=1)), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -33,7 +33,8 @@ celery_app.conf.update(
     # Memory optimization settings
     worker_prefetch_multiplier=1,  # Don't prefetch tasks (saves memory)
     task_acks_late=True,  # Acknowledge after task completes
-    worker_max_tasks_per_child=5,  # Restart worker after 5 tasks to free memory
+    # Documents are spooled to disk rather than held in memory, so children can be recycled less often
+    worker_max_tasks_per_child=int(os.getenv("WORKER_MAX_TASKS_PER_CHILD", "50")),
 )
 
 celery_app.autodiscover_tasks(["worker.tasks"])
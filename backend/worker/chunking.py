@@ -0,0 +1,133 @@
+"""
+Token-aware text chunker.
+
+Splits text on the coarsest boundary that fits: paragraphs, then lines, then
+sentences, then words, and as a last resort raw tokens. Pieces are then packed
+greedily into chunks of at most CHUNK_MAX_TOKENS, with the last
+CHUNK_OVERLAP_TOKENS worth of whole pieces carried into the next chunk.
+
+Each text is encoded exactly once. The byte length of every token (from a table
+built once per encoding) gives the byte offset where each token starts, and all
+splitting happens on byte offsets of the UTF-8 text: a piece's token count is the
+number of token starts inside it, found by bisection. Throughput is therefore
+one tiktoken encode plus a few NumPy operations per text.
+"""
+from app.openai_client import EMBEDDING_MODEL
+from common.tokens import get_encoding
+from bisect import bisect_left
+from typing import Iterator, List, Tuple
+import os
+import re
+import numpy as np
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "30"))
+
+# Coarsest first; separators stay attached to the end of the piece they close
+SEPARATORS = [b"\n\n", b"\n", b". ", b" "]
+_SEPARATOR_PATTERNS = [re.compile(re.escape(separator)) for separator in SEPARATORS]
+
+# Byte length of every token id, per encoding
+_token_lengths = {}
+
+def _token_length_table(encoding) -> np.ndarray:
+    table = _token_lengths.get(encoding.name)
+    if table is None:
+        table = np.zeros(encoding.max_token_value + 1, dtype=np.int64)
+        for token in range(len(table)):
+            try:
+                table[token] = len(encoding.decode_single_token_bytes(token))
+            except KeyError:  # unused ids between the ranks and the special tokens
+                pass
+        _token_lengths[encoding.name] = table
+    return table
+
+class _Text:
+    """UTF-8 bytes of a text and the byte offset at which each of its tokens starts."""
+
+    def __init__(self, text: str, encoding):
+        self.data = text.encode("utf-8")
+        lengths = _token_length_table(encoding)[np.asarray(encoding.encode_ordinary(text), dtype=np.int64)]
+        # A list, because bisect on a short list beats numpy's per-call overhead
+        self.starts = (np.cumsum(lengths) - lengths).tolist()
+
+    def tokens(self, start: int, stop: int) -> int:
+        """Tokens starting within data[start:stop]. Summed over adjacent ranges this is exact;
+        for one range it can be off by one where a token straddles its edge."""
+        return bisect_left(self.starts, stop) - bisect_left(self.starts, start)
+
+    def char_boundary(self, offset: int) -> int:
+        """The first offset at or after `offset` that does not fall inside a UTF-8 character."""
+        while offset < len(self.data) and 0x80 <= self.data[offset] < 0xC0:
+            offset += 1
+        return offset
+
+def _split_keep(text: _Text, start: int, stop: int, level: int) -> List[Tuple[int, int]]:
+    ranges = []
+    for match in _SEPARATOR_PATTERNS[level].finditer(text.data, start, stop):
+        ranges.append((start, match.end()))
+        start = match.end()
+    if start < stop:
+        ranges.append((start, stop))
+    return ranges
+
+def _pieces(text: _Text, start: int, stop: int, max_tokens: int, level: int = 0) -> Iterator[Tuple[int, int, int]]:
+    """Yield (start, stop, token_count) byte ranges covering data[start:stop] in order, each at most max_tokens long."""
+    tokens = text.tokens(start, stop)
+    if tokens <= max_tokens:
+        yield start, stop, tokens
+    elif level == len(SEPARATORS):
+        first = bisect_left(text.starts, start)
+        bounds = [start] + [text.char_boundary(offset) for offset in text.starts[first + max_tokens::max_tokens] if offset < stop] + [stop]
+        for piece_start, piece_stop in zip(bounds, bounds[1:]):
+            if piece_start < piece_stop:
+                yield piece_start, piece_stop, text.tokens(piece_start, piece_stop)
+    else:
+        for piece_start, piece_stop in _split_keep(text, start, stop, level):
+            yield from _pieces(text, piece_start, piece_stop, max_tokens, level + 1)
+
+def split_text_with_counts(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    model: str = EMBEDDING_MODEL,
+) -> Iterator[Tuple[str, int]]:
+    """Lazily yield (chunk, token_count) pairs of at most about max_tokens tokens each.
+
+    Counts come from the single encoding of the whole text, so a chunk's count can
+    be off by a token where a token straddles its edge. Callers that need the
+    counts (embedding batching) can use them instead of encoding the chunks again.
+    """
+    encoded = _Text(text, get_encoding(model))
+    # Pieces are contiguous, so a chunk is the byte range from its first piece to its last
+    window: List[Tuple[int, int, int]] = []
+    used = 0
+
+    def chunk_text():
+        return encoded.data[window[0][0]:window[-1][1]].decode("utf-8").strip()
+
+    for piece in _pieces(encoded, 0, len(encoded.data), max_tokens):
+        tokens = piece[2]
+        if window and used + tokens > max_tokens:
+            chunk = chunk_text()
+            if chunk:
+                yield chunk, used
+            # Carry whole trailing pieces into the next chunk as overlap
+            carried, carried_tokens = [], 0
+            for p in reversed(window):
+                if carried_tokens + p[2] > overlap_tokens or carried_tokens + p[2] + tokens > max_tokens:
+                    break
+                carried.append(p)
+                carried_tokens += p[2]
+            window, used = carried[::-1], carried_tokens
+        window.append(piece)
+        used += tokens
+    if window:
+        chunk = chunk_text()
+        if chunk:
+            yield chunk, used
+
+def split_text(text: str, **kwargs) -> Iterator[str]:
+    """Lazily yield chunks of text of at most about CHUNK_MAX_TOKENS tokens."""
+    for chunk, _ in split_text_with_counts(text, **kwargs):
+        yield chunk
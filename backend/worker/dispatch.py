@@ -0,0 +1,13 @@
+"""
+Enqueue worker tasks by name.
+
+The API imports this instead of worker.tasks, so API processes never load the
+task modules or the document extraction libraries they depend on.
+"""
+from worker.celery_app import celery_app
+
+def enqueue_process_document(upload_id: int):
+    return celery_app.send_task("process_document", args=[upload_id])
+
+def enqueue_analysis_job(job_id: int):
+    return celery_app.send_task("run_analysis_job", args=[job_id])
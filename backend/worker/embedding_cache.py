@@ -0,0 +1,214 @@
+from app.database import get_session_local
+from app import models
+from common.redis_utils import get_redis_client
+from sqlalchemy import select, update, delete, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from array import array
+import hashlib
+import os
+import re
+import time
+import unicodedata
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+# Hot tier: Redis keys with a TTL plus an LRU sorted set that caps the key count
+EMBEDDING_CACHE_REDIS_TTL = int(os.getenv("EMBEDDING_CACHE_REDIS_TTL", str(7 * 24 * 3600)))
+EMBEDDING_CACHE_REDIS_MAX_KEYS = int(os.getenv("EMBEDDING_CACHE_REDIS_MAX_KEYS", "50000"))
+# Cold tier: Postgres rows, least recently used entries are evicted past this count
+EMBEDDING_CACHE_DB_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_DB_MAX_ROWS", "1000000"))
+# The size check runs every this many cold-tier writes per process, not on each one
+EMBEDDING_CACHE_EVICT_EVERY = int(os.getenv("EMBEDDING_CACHE_EVICT_EVERY", "50"))
+# Most rows deleted by one eviction, so a single write never carries a huge delete
+EMBEDDING_CACHE_EVICT_BATCH = 10000
+
+KEY_PREFIX = "embedding_cache:v1"
+LRU_KEY = f"{KEY_PREFIX}:lru"
+STATS_KEY = f"{KEY_PREFIX}:stats"
+
+_whitespace = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    return _whitespace.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+def _redis_key(digest: str, model: str, dimensions: int) -> str:
+    return f"{KEY_PREFIX}:{model}:{dimensions}:{digest}"
+
+def _pack(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+def _unpack(raw: bytes):
+    values = array("f")
+    values.frombytes(raw)
+    return values.tolist()
+
+def _record_stats(**counters):
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        for name, amount in counters.items():
+            if amount:
+                pipe.hincrby(STATS_KEY, name, amount)
+        pipe.execute()
+    except Exception as e:
+        print(f"Embedding cache stats unavailable: {e}")
+
+def _get_hot(digests, model, dimensions):
+    keys = [_redis_key(d, model, dimensions) for d in digests]
+    try:
+        client = get_redis_client()
+        raw_values = client.mget(keys)
+        hits = {d: _unpack(raw) for d, raw in zip(digests, raw_values) if raw is not None}
+        if hits:
+            now = time.time()
+            client.zadd(LRU_KEY, {_redis_key(d, model, dimensions): now for d in hits})
+        return hits
+    except Exception as e:
+        print(f"Embedding cache hot tier unavailable: {e}")
+        return {}
+
+def _put_hot(vectors_by_digest, model, dimensions):
+    if not vectors_by_digest:
+        return
+    try:
+        client = get_redis_client()
+        now = time.time()
+        pipe = client.pipeline(transaction=False)
+        for digest, vector in vectors_by_digest.items():
+            key = _redis_key(digest, model, dimensions)
+            pipe.set(key, _pack(vector), ex=EMBEDDING_CACHE_REDIS_TTL)
+            pipe.zadd(LRU_KEY, {key: now})
+        pipe.zcard(LRU_KEY)
+        overflow = pipe.execute()[-1] - EMBEDDING_CACHE_REDIS_MAX_KEYS
+        if overflow > 0:
+            evicted = [key for key, _ in client.zpopmin(LRU_KEY, overflow)]
+            if evicted:
+                client.delete(*evicted)
+    except Exception as e:
+        print(f"Embedding cache hot tier unavailable: {e}")
+
+def _get_cold(db, digests, model, dimensions):
+    Entry = models.EmbeddingCacheEntry
+    rows = db.execute(
+        select(Entry.id, Entry.content_hash, Entry.embedding).where(
+            Entry.content_hash.in_(digests),
+            Entry.model == model,
+            Entry.dimensions == dimensions,
+        )
+    ).all()
+    if rows:
+        db.execute(update(Entry).where(Entry.id.in_([r.id for r in rows])).values(last_used_at=func.now()))
+    return {r.content_hash: list(r.embedding) for r in rows}
+
+_puts_since_eviction = 0
+
+# Dialects with INSERT ... ON CONFLICT DO NOTHING; other engines skip the cold tier
+_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+def _put_cold(db, entries, model, dimensions):
+    if not entries:
+        return
+    Entry = models.EmbeddingCacheEntry
+    dialect = db.get_bind().dialect.name
+    insert = _INSERTS.get(dialect)
+    if insert is None:
+        print(f"Embedding cache cold tier not supported on {dialect}; skipping write")
+        return
+    stmt = insert(Entry).values([
+        {
+            "content_hash": digest,
+            "model": model,
+            "dimensions": dimensions,
+            "embedding": vector,
+            "token_count": tokens,
+        }
+        for digest, (vector, tokens) in entries.items()
+    ]).on_conflict_do_nothing(index_elements=["content_hash", "model", "dimensions"])
+    db.execute(stmt)
+    global _puts_since_eviction
+    _puts_since_eviction += 1
+    if _puts_since_eviction >= EMBEDDING_CACHE_EVICT_EVERY:
+        _puts_since_eviction = 0
+        _evict_cold(db)
+
+def _estimated_rows(db) -> int:
+    """Planner row estimate for the cold tier; count(*) would scan the whole table."""
+    Entry = models.EmbeddingCacheEntry
+    if db.get_bind().dialect.name == "postgresql":
+        estimate = db.scalar(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass('embedding_cache')"))
+        # -1 until the table is first vacuumed or analyzed, which only happens while it is small
+        return max(estimate or 0, 0)
+    return db.scalar(select(func.count(Entry.id)))
+
+def _evict_cold(db):
+    Entry = models.EmbeddingCacheEntry
+    overflow = min(_estimated_rows(db) - EMBEDDING_CACHE_DB_MAX_ROWS, EMBEDDING_CACHE_EVICT_BATCH)
+    if overflow > 0:
+        oldest = select(Entry.id).order_by(Entry.last_used_at.asc()).limit(overflow).scalar_subquery()
+        db.execute(delete(Entry).where(Entry.id.in_(oldest)))
+
+def get_many(digests, model: str, dimensions: int):
+    """Look up embeddings for content hashes, checking Redis first and then Postgres.
+
+    Returns a dict of digest -> vector for every hit. Cold-tier hits are promoted to Redis.
+    """
+    digests = list(set(digests))
+    if not EMBEDDING_CACHE_ENABLED or not digests:
+        return {}
+
+    hits = _get_hot(digests, model, dimensions)
+    remaining = [d for d in digests if d not in hits]
+    cold_hits = {}
+    if remaining:
+        db = get_session_local()()
+        try:
+            cold_hits = _get_cold(db, remaining, model, dimensions)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Embedding cache cold tier unavailable: {e}")
+        finally:
+            db.close()
+        _put_hot(cold_hits, model, dimensions)
+        hits.update(cold_hits)
+
+    _record_stats(
+        hot_hits=len(hits) - len(cold_hits),
+        cold_hits=len(cold_hits),
+        misses=len(digests) - len(hits),
+    )
+    return hits
+
+def put_many(entries, model: str, dimensions: int):
+    """Store freshly computed embeddings. `entries` maps digest -> (vector, token_count)."""
+    if not EMBEDDING_CACHE_ENABLED or not entries:
+        return
+    _put_hot({d: vector for d, (vector, _) in entries.items()}, model, dimensions)
+    db = get_session_local()()
+    try:
+        _put_cold(db, entries, model, dimensions)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Embedding cache cold tier unavailable: {e}")
+    finally:
+        db.close()
+
+def record_savings(tokens_saved: int):
+    _record_stats(tokens_saved=tokens_saved)
+
+def get_stats():
+    """Return cumulative hit/miss counters and current tier sizes."""
+    stats = {"hot_hits": 0, "cold_hits": 0, "misses": 0, "tokens_saved": 0}
+    try:
+        client = get_redis_client()
+        for name, value in client.hgetall(STATS_KEY).items():
+            stats[name.decode()] = int(value)
+        stats["hot_entries"] = client.zcard(LRU_KEY)
+    except Exception as e:
+        print(f"Embedding cache stats unavailable: {e}")
+    lookups = stats["hot_hits"] + stats["cold_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["hot_hits"] + stats["cold_hits"]) / lookups, 4) if lookups else 0.0
+    return stats
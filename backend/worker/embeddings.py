@@ -0,0 +1,57 @@
+from app.openai_client import openai_client, embedding_options, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+from common.tokens import count_tokens
+from worker import embedding_cache
+import os
+
+# OpenAI accepts up to 2048 inputs and ~300k tokens per embeddings request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "200000"))
+
+def prepare_text(text: str) -> str:
+    return text.replace("\n", " ")
+
+def iter_batches(texts, token_counts):
+    """Group texts so each request stays under both the input count and token limits."""
+    batch, batch_tokens = [], 0
+    for text, tokens in zip(texts, token_counts):
+        if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or batch_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _create_embeddings(texts, token_counts):
+    vectors = []
+    for batch in iter_batches(texts, token_counts):
+        response = openai_client.embeddings.create(input=batch, model=EMBEDDING_MODEL, **embedding_options())
+        vectors.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+    return vectors
+
+def embed_texts(texts, token_counts=None):
+    """Embed a list of texts with as few embeddings.create calls as the limits allow.
+
+    Texts are looked up in the embedding cache first; only unseen texts are sent to
+    OpenAI, each at most once. Vectors are returned in the same order as the input texts.
+    Pass token_counts when they are already known (e.g. from the chunker) to skip
+    encoding the texts again.
+    """
+    prepared = [prepare_text(t) for t in texts]
+    digests = [embedding_cache.content_hash(t) for t in prepared]
+    cached = embedding_cache.get_many(digests, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    if token_counts is None:
+        token_counts = [count_tokens(t, EMBEDDING_MODEL) for t in prepared]
+    tokens_by_digest = dict(zip(digests, token_counts))
+
+    pending = {}
+    for digest, text in zip(digests, prepared):
+        if digest not in cached and digest not in pending:
+            pending[digest] = text
+
+    fresh = dict(zip(pending, _create_embeddings(list(pending.values()), [tokens_by_digest[d] for d in pending])))
+    embedding_cache.put_many({d: (v, tokens_by_digest[d]) for d, v in fresh.items()}, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    embedding_cache.record_savings(sum(tokens for d, tokens in zip(digests, token_counts) if d in cached))
+
+    vectors = {**cached, **fresh}
+    return [vectors[d] for d in digests]
@@ -1,52 +1,263 @@
-import fitz  # PyMuPDF
-import docx
-import pandas as pd
-from PIL import Image
-import pytesseract
+import csv
+import datetime
 import io
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, NamedTuple, Optional
 
-def extract_text_from_pdf(file_bytes):
-    doc = fitz.open(stream=file_bytes, filetype="pdf")
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    
-    # If text is too short, try OCR
-    if len(text.strip()) < 100:
-        text = ""
-        for page in doc:
-            pix = page.get_pixmap()
-            img = Image.open(io.BytesIO(pix.tobytes()))
-            text += pytesseract.image_to_string(img)
-    return text
-
-def extract_text_from_docx(file_bytes):
-    doc = docx.Document(io.BytesIO(file_bytes))
-    return "\n".join([para.text for para in doc.paragraphs])
-
-def extract_text_from_xlsx(file_bytes):
-    df_dict = pd.read_excel(io.BytesIO(file_bytes), sheet_name=None)
-    text = ""
-    for sheet_name, df in df_dict.items():
-        text += f"Sheet: {sheet_name}\n"
-        text += df.to_string() + "\n\n"
-    return text
-
-def extract_text_from_image(file_bytes):
-    img = Image.open(io.BytesIO(file_bytes))
-    return pytesseract.image_to_string(img)
-
-def extract_content(file_bytes, content_type, filename):
+# Format libraries (PyMuPDF, python-docx, openpyxl, pandas, PIL, pytesseract) are
+# imported inside the functions that use them, so importing this module stays cheap
+# and each process only loads what the documents it sees need.
+
+# Extractors take a path to a local file rather than bytes, so large documents are
+# read lazily from disk instead of being held in memory several times over
+
+# Word documents have no pages; paragraphs are grouped into units of roughly this size
+DOCX_UNIT_CHARS = int(os.getenv("DOCX_UNIT_CHARS", "4000"))
+# Spreadsheet rows are grouped into units of at most this many characters (header included);
+# kept within the chunk size so chunks hold whole rows
+SHEET_UNIT_CHARS = int(os.getenv("SHEET_UNIT_CHARS", "800"))
+# Pages whose text layer has fewer characters than this are treated as scanned and OCR'd
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "20"))
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+# Default cap on OCR threads: os.cpu_count() and even the affinity mask report the host's
+# CPUs, not a container's CPU quota
+OCR_WORKERS_DEFAULT_MAX = 4
+
+def _usable_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS and Windows
+        return os.cpu_count() or 1
+
+# Threads used to OCR one document; 0 or 1 runs OCR serially in the task
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(_usable_cpus(), OCR_WORKERS_DEFAULT_MAX))))
+
+class ExtractedUnit(NamedTuple):
+    """One piece of a document: a PDF page, a spreadsheet sheet, a block of paragraphs or an image."""
+    page: Optional[int]  # 1-based page (PDF, image) or sheet number; None for Word documents
+    text: str
+    method: str  # "text" for a text layer, "ocr" for recognized text
+    meta: dict = {}
+
+def _render_page(page, dpi):
+    """Rasterize one PDF page; returns (image, seconds)."""
+    from PIL import Image
+    start = time.perf_counter()
+    pix = page.get_pixmap(dpi=dpi)
+    img = Image.frombytes("RGBA" if pix.alpha else "RGB", (pix.width, pix.height), pix.samples)
+    return img, time.perf_counter() - start
+
+def _recognize(img, render_seconds=0.0):
+    """Run tesseract on a rendered page; returns (text, seconds including rendering)."""
+    import pytesseract
+    start = time.perf_counter()
+    text = pytesseract.image_to_string(img)
+    return text, render_seconds + time.perf_counter() - start
+
+def _ocr_page(page, dpi):
+    """Render one PDF page and recognize its text; returns (text, seconds)."""
+    return _recognize(*_render_page(page, dpi))
+
+def _ocr_unit(page_number, result):
+    text, seconds = result
+    return ExtractedUnit(page_number, text, "ocr", {"ocr_seconds": round(seconds, 3), "ocr_dpi": OCR_DPI})
+
+def _in_page_order(items, window):
+    """Yield units in order from a stream of units and (page_number, future) pairs.
+
+    Finished units pass straight through; an OCR future is only waited on once
+    `window` items are queued behind it, so the pool stays busy.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(item)
+        while pending and (isinstance(pending[0], ExtractedUnit) or len(pending) > window):
+            yield _resolve(pending.popleft())
+    while pending:
+        yield _resolve(pending.popleft())
+
+def _resolve(item):
+    if isinstance(item, ExtractedUnit):
+        return item
+    page_number, future = item
+    return _ocr_unit(page_number, future.result())
+
+def pdf_page_count(path) -> int:
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+def write_pdf_pages(path, first_page, last_page, out_path):
+    """Copy pages first_page..last_page (1-based, inclusive) of a PDF into a new file."""
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc, fitz.open() as part:
+        part.insert_pdf(doc, from_page=first_page - 1, to_page=last_page - 1)
+        part.save(out_path, garbage=3)
+
+def iter_pdf_units(path, first_page=1, last_page=None) -> Iterator[ExtractedUnit]:
+    """Yield PDF pages first_page..last_page (1-based, inclusive) in order, OCR'ing only pages without a usable text layer.
+
+    Scanned pages are rendered on the calling thread (PyMuPDF documents are not
+    thread-safe) and recognized on a thread pool while later pages are read;
+    tesseract runs as a subprocess, so the threads do not contend for the GIL. At
+    most two pages per OCR thread are in flight, so memory stays bounded.
+    """
+    import fitz  # PyMuPDF
+    pool = None
+
+    def page_items(doc):
+        nonlocal pool
+        for page in doc.pages(first_page - 1, last_page):
+            page_number = page.number + 1
+            text = page.get_text()
+            if len(text.strip()) >= OCR_MIN_PAGE_CHARS:
+                yield ExtractedUnit(page_number, text, "text")
+            elif OCR_WORKERS > 1:
+                if pool is None:
+                    # One core per tesseract process; its own OpenMP threads would oversubscribe the CPUs
+                    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+                    pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+                yield page_number, pool.submit(_recognize, *_render_page(page, OCR_DPI))
+            else:
+                yield _ocr_unit(page_number, _ocr_page(page, OCR_DPI))
+
+    ocr_pages, ocr_seconds = 0, 0.0
+    try:
+        with fitz.open(path) as doc:
+            for unit in _in_page_order(page_items(doc), window=max(OCR_WORKERS, 1) * 2):
+                if unit.method == "ocr":
+                    ocr_pages += 1
+                    ocr_seconds += unit.meta["ocr_seconds"]
+                yield unit
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if ocr_pages:
+        print(f"OCR'd {ocr_pages} pages of {os.path.basename(path)} at {OCR_DPI} dpi in {ocr_seconds:.1f}s of OCR time")
+
+def iter_docx_units(path, skip=0) -> Iterator[ExtractedUnit]:
+    """Yield groups of paragraphs; the first `skip` groups are only measured, not built."""
+    import docx
+    doc = docx.Document(path)
+    lines, size, first = [], 0, 1
+    for i, para in enumerate(doc.paragraphs, start=1):
+        if skip:
+            size += len(para.text) + 1
+            if size >= DOCX_UNIT_CHARS:
+                skip, size, first = skip - 1, 0, i + 1
+            continue
+        lines.append(para.text)
+        size += len(para.text) + 1
+        if size >= DOCX_UNIT_CHARS:
+            yield ExtractedUnit(None, "\n".join(lines), "text", {"paragraphs": [first, i]})
+            lines, size, first = [], 0, i + 1
+    if lines:
+        yield ExtractedUnit(None, "\n".join(lines), "text", {"paragraphs": [first, first + len(lines) - 1]})
+
+def _format_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time():
+        return value.date().isoformat()
+    return value
+
+def _format_row(values) -> str:
+    """One row as a compact CSV line: no padding, trailing empty cells dropped, 12.0 written as 12."""
+    cells = [_format_cell(v) for v in values]
+    while cells and cells[-1] == "":
+        cells.pop()
+    out = io.StringIO()
+    csv.writer(out, lineterminator="").writerow(cells)
+    return out.getvalue()
+
+def iter_row_groups(sheet_number, sheet_name, rows) -> Iterator[ExtractedUnit]:
+    """Group (row_number, values) pairs into units of whole rows, each starting with the sheet's header row.
+
+    Only one group is held in memory at a time. The first non-empty row is taken as the header.
+    """
+    header, lines, size, first = None, [], 0, None
+    for row_number, values in rows:
+        line = _format_row(values)
+        if not line.strip(","):
+            continue
+        if header is None:
+            header = f"Sheet: {sheet_name}\n{line}"
+            continue
+        if lines and size + len(line) + 1 > SHEET_UNIT_CHARS:
+            yield ExtractedUnit(sheet_number, header + "\n" + "\n".join(lines), "text", {"sheet": sheet_name, "rows": [first, last]})
+            lines, size = [], len(header)
+        if not lines:
+            first, size = row_number, len(header)
+        lines.append(line)
+        size += len(line) + 1
+        last = row_number
+    if lines:
+        yield ExtractedUnit(sheet_number, header + "\n" + "\n".join(lines), "text", {"sheet": sheet_name, "rows": [first, last]})
+    elif header is not None:
+        yield ExtractedUnit(sheet_number, header, "text", {"sheet": sheet_name})
+
+def iter_xlsx_units(path) -> Iterator[ExtractedUnit]:
+    import openpyxl
+    # read_only streams rows from the file instead of loading every sheet into memory
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for number, sheet in enumerate(workbook.worksheets, start=1):
+            rows = enumerate(sheet.iter_rows(values_only=True), start=1)
+            yield from iter_row_groups(number, sheet.title, rows)
+    finally:
+        workbook.close()
+
+def iter_xls_units(path) -> Iterator[ExtractedUnit]:
+    import pandas as pd
+    # Legacy .xls is not supported by openpyxl; the workbook is parsed once and
+    # converted to a DataFrame one sheet at a time
+    with pd.ExcelFile(path) as book:
+        for number, sheet_name in enumerate(book.sheet_names, start=1):
+            df = book.parse(sheet_name, header=None)
+            rows = enumerate(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None), start=1)
+            yield from iter_row_groups(number, sheet_name, rows)
+
+def iter_image_units(path) -> Iterator[ExtractedUnit]:
+    from PIL import Image
+    import pytesseract
+    start = time.perf_counter()
+    with Image.open(path) as img:
+        text = pytesseract.image_to_string(img)
+    yield ExtractedUnit(1, text, "ocr", {"ocr_seconds": round(time.perf_counter() - start, 3)})
+
+def _skip_units(units, count) -> Iterator[ExtractedUnit]:
+    """Drop the first `count` units; closing this closes `units` too."""
+    try:
+        for index, unit in enumerate(units):
+            if index >= count:
+                yield unit
+    finally:
+        units.close()
+
+def iter_units(path, content_type, filename, first_page=1, last_page=None, skip_units=0) -> Iterator[ExtractedUnit]:
+    """Yield a document's text one unit at a time, so callers can chunk and embed while extraction continues.
+
+    first_page/last_page restrict a PDF to a page range; other formats are always read whole.
+    skip_units resumes after that many units. PDF pages and images that are skipped are
+    never extracted or OCR'd, and skipped Word paragraphs are not joined. Spreadsheet
+    rows still have to be read, because unit boundaries depend on their sizes.
+    """
     ext = os.path.splitext(filename)[1].lower()
     
     if ext == ".pdf":
-        return extract_text_from_pdf(file_bytes)
+        return iter_pdf_units(path, first_page + skip_units, last_page)
     elif ext in [".docx", ".doc"]:
-        return extract_text_from_docx(file_bytes)
-    elif ext in [".xlsx", ".xls"]:
-        return extract_text_from_xlsx(file_bytes)
+        return iter_docx_units(path, skip_units)
+    elif ext == ".xlsx":
+        return _skip_units(iter_xlsx_units(path), skip_units)
+    elif ext == ".xls":
+        return _skip_units(iter_xls_units(path), skip_units)
     elif ext in [".png", ".jpg", ".jpeg", ".webp"]:
-        return extract_text_from_image(file_bytes)
+        return iter_image_units(path) if not skip_units else iter([])
     else:
-        return "Unsupported file type"
+        return iter([ExtractedUnit(None, "Unsupported file type", "none")][skip_units:])
@@ -0,0 +1,119 @@
+"""
+MinHash/LSH near-duplicate detection for chunks.
+
+Each chunk gets a MinHash signature over its word shingles. Signatures are cut
+into LSH bands whose hashes are stored in `chunk_lsh_bands`, scoped to the
+project and organization, so candidate near-duplicates are found with one
+indexed lookup. Candidates are confirmed by comparing signatures, whose
+agreement estimates the Jaccard similarity of the shingle sets.
+
+Near-duplicates are stored without an embedding and linked to the chunk they
+repeat through `ExtractedChunk.duplicate_of_id`; retrieval and analysis skip them.
+"""
+from sqlalchemy import insert, tuple_
+from app import models
+from worker.embedding_cache import normalize_text
+import hashlib
+import numpy as np
+import os
+import zlib
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() == "true"
+# Estimated Jaccard similarity of word shingles above which a chunk counts as a near-duplicate
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+NEAR_DUP_SHINGLE_WORDS = int(os.getenv("NEAR_DUP_SHINGLE_WORDS", "3"))
+
+# Changing these invalidates stored signatures and bands
+NUM_PERM = 128
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+
+_PRIME = (1 << 61) - 1
+# Fixed seed: signatures must be identical in every process
+_rng = np.random.RandomState(20240501)
+_A = _rng.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    words = normalize_text(text).lower().split()
+    n = NEAR_DUP_SHINGLE_WORDS
+    shingles = {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+def signature(text: str) -> bytes:
+    """MinHash signature of text as NUM_PERM little-endian uint32 values."""
+    hashes = _shingle_hashes(text)
+    # a < 2^31 and hashes < 2^32, so a * x + b cannot overflow uint64
+    permuted = (np.outer(_A, hashes) + _B[:, None]) % _PRIME
+    return (permuted.min(axis=1) & 0xFFFFFFFF).astype("<u4").tobytes()
+
+def similarity(a: bytes, b: bytes) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(np.frombuffer(a, dtype="<u4") == np.frombuffer(b, dtype="<u4")))
+
+def band_keys(sig: bytes):
+    """(band, bucket) pairs of a signature; bucket is a signed 64-bit hash of the band's rows."""
+    width = LSH_ROWS * 4
+    return [
+        (band, int.from_bytes(hashlib.blake2b(sig[band * width:(band + 1) * width], digest_size=8).digest(), "big", signed=True))
+        for band in range(LSH_BANDS)
+    ]
+
+def _scope(query, project_id, organization_id):
+    Band = models.ChunkLshBand
+    query = query.filter(Band.project_id == project_id)
+    if organization_id is None:
+        return query.filter(Band.organization_id.is_(None))
+    return query.filter(Band.organization_id == organization_id)
+
+def match_batch(db, project_id, organization_id, texts):
+    """Find near-duplicates for a batch of texts before they are embedded.
+
+    Returns (signatures, duplicate_of), where duplicate_of[i] is the id of an
+    existing chunk that text i repeats, ("batch", j) for an earlier text j of the
+    same batch, or None if text i is new.
+    """
+    signatures = [signature(t) for t in texts]
+    keys = [band_keys(sig) for sig in signatures]
+
+    wanted = {key for per_text in keys for key in per_text}
+    candidates = {}
+    if wanted:
+        Band, Chunk = models.ChunkLshBand, models.ExtractedChunk
+        rows = _scope(db.query(Band.band, Band.bucket, Band.chunk_id), project_id, organization_id).filter(
+            tuple_(Band.band, Band.bucket).in_(list(wanted))
+        ).all()
+        by_key = {}
+        for band, bucket, chunk_id in rows:
+            by_key.setdefault((band, bucket), set()).add(chunk_id)
+        chunk_ids = {chunk_id for ids in by_key.values() for chunk_id in ids}
+        stored = dict(db.query(Chunk.id, Chunk.minhash).filter(Chunk.id.in_(chunk_ids)).all()) if chunk_ids else {}
+        candidates = {key: [(chunk_id, stored[chunk_id]) for chunk_id in ids if stored.get(chunk_id)] for key, ids in by_key.items()}
+
+    duplicate_of, batch_index = [], {}
+    for i, (sig, per_text) in enumerate(zip(signatures, keys)):
+        best, best_score = None, NEAR_DUP_THRESHOLD
+        seen = set()
+        for key in per_text:
+            for ref, other in candidates.get(key, []) + batch_index.get(key, []):
+                if ref in seen:
+                    continue
+                seen.add(ref)
+                score = similarity(sig, other)
+                if score >= best_score:
+                    best, best_score = ref, score
+        duplicate_of.append(best)
+        if best is None:
+            for key in per_text:
+                batch_index.setdefault(key, []).append((("batch", i), sig))
+    return signatures, duplicate_of
+
+def index_chunks(db, project_id, organization_id, chunk_ids, signatures):
+    """Add the LSH bands of newly stored (non-duplicate) chunks to the project's index."""
+    rows = [
+        {"project_id": project_id, "organization_id": organization_id, "band": band, "bucket": bucket, "chunk_id": chunk_id}
+        for chunk_id, sig in zip(chunk_ids, signatures)
+        for band, bucket in band_keys(sig)
+    ]
+    if rows:
+        db.execute(insert(models.ChunkLshBand), rows)
@@ -1,70 +1,540 @@
 from worker.celery_app import celery_app
-from worker.extraction import extract_content
-from app.database import get_session_local
+from worker.extraction import iter_units, pdf_page_count, write_pdf_pages
+from app.database import get_session_local, RETRIEVAL_BACKEND
 from app import models
-from app.openai_client import openai_client
+from app.analysis import generate_analysis
+from app.analysis_jobs import update_job, transition_job, ACTIVE_STATUSES
+from worker.embeddings import embed_texts, EMBEDDING_BATCH_SIZE
+from worker import near_duplicates
+from worker.chunking import split_text_with_counts, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from worker.extraction import OCR_DPI
+from app.openai_client import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
 from common.s3_utils import S3Service
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from sqlalchemy import insert, update, select, func, cast, literal, null, and_, or_, String, JSON
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError
+from celery import chord
+from celery.utils.time import get_exponential_backoff_interval
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import openai
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
 import os
 
-# Using the imported openai_client from app.openai_client
+# PDFs with more pages than this are split into page ranges processed by separate tasks
+FANOUT_PAGE_THRESHOLD = int(os.getenv("FANOUT_PAGE_THRESHOLD", "200"))
+FANOUT_RANGE_PAGES = int(os.getenv("FANOUT_RANGE_PAGES", "50"))
+# Page-range PDFs uploaded in parallel before the range tasks are dispatched
+FANOUT_UPLOAD_CONCURRENCY = int(os.getenv("FANOUT_UPLOAD_CONCURRENCY", "4"))
 
-def get_embedding(text):
-    text = text.replace("\n", " ")
-    return openai_client.embeddings.create(input=[text], model="text-embedding-3-small").data[0].embedding
+# Chunks are committed (with the progress cursor) at the first unit boundary after this many
+INGEST_COMMIT_CHUNKS = int(os.getenv("INGEST_COMMIT_CHUNKS", "256"))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "5"))
+# Retry delays grow exponentially from this many seconds, with jitter, up to the maximum
+INGEST_RETRY_BACKOFF = int(os.getenv("INGEST_RETRY_BACKOFF", "30"))
+INGEST_RETRY_BACKOFF_MAX = int(os.getenv("INGEST_RETRY_BACKOFF_MAX", "600"))
+# Errors worth retrying: rate limits, timeouts and OpenAI outages
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
 
-@celery_app.task(name="process_document")
-def process_document(upload_id: int):
+# Bump when extraction or chunking output changes, so identical files are re-processed instead of cloned
+INGEST_PIPELINE_REVISION = 4
+# Identical files ingested with the same pipeline version produce the same chunks and vectors
+PIPELINE_VERSION = f"r{INGEST_PIPELINE_REVISION}:chunk{CHUNK_MAX_TOKENS}-{CHUNK_OVERLAP_TOKENS}:ocr{OCR_DPI}:{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}"
+
+def split_unit(unit, filename):
+    """Split one extracted unit on its own, so every chunk keeps the page or sheet it came from."""
+    metadata = {"filename": filename, "method": unit.method, **unit.meta}
+    if unit.page is not None:
+        metadata["page"] = unit.page
+    for text, tokens in split_text_with_counts(unit.text):
+        yield text, tokens, metadata
+
+def store_chunks(db, upload, chunks):
+    """Embed (text, token_count, metadata) chunks and store them with multi-row inserts.
+
+    Near-duplicates of chunks already in the project (or earlier in the batch) are
+    not embedded; they are stored without a vector and linked to the chunk they repeat.
+    """
+    if not chunks:
+        return
+    Chunk = models.ExtractedChunk
+    texts = [text for text, _, _ in chunks]
+    if near_duplicates.NEAR_DUP_ENABLED:
+        signatures, duplicate_of = near_duplicates.match_batch(db, upload.project_id, upload.organization_id, texts)
+    else:
+        signatures, duplicate_of = [None] * len(chunks), [None] * len(chunks)
+
+    def row(i, **fields):
+        text, _, metadata = chunks[i]
+        return {
+            "content": text,
+            "metadata_json": metadata,
+            "minhash": signatures[i],
+            "upload_id": upload.id,
+            "project_id": upload.project_id,
+            "organization_id": upload.organization_id,
+            **fields,
+        }
+
+    originals = [i for i, dup in enumerate(duplicate_of) if dup is None]
+    embeddings = embed_texts([texts[i] for i in originals], [chunks[i][1] for i in originals])
+    ids = db.execute(
+        insert(Chunk).returning(Chunk.id, sort_by_parameter_order=True),
+        [row(i, embedding=embedding) for i, embedding in zip(originals, embeddings)],
+    ).scalars().all() if originals else []
+    if near_duplicates.NEAR_DUP_ENABLED:
+        near_duplicates.index_chunks(db, upload.project_id, upload.organization_id, ids, [signatures[i] for i in originals])
+
+    id_by_position = dict(zip(originals, ids))
+    duplicates = [
+        row(i, embedding=None, duplicate_of_id=id_by_position[dup[1]] if isinstance(dup, tuple) else dup)
+        for i, dup in enumerate(duplicate_of) if dup is not None
+    ]
+    if duplicates:
+        db.execute(insert(Chunk), duplicates)
+        print(f"Upload {upload.id}: {len(duplicates)} of {len(chunks)} chunks are near-duplicates, not embedded")
+
+def get_checkpoint(db, upload_id, first_page=1, last_page=None):
+    """Load or create the progress cursor for an upload (or one page range of it)."""
+    query = db.query(models.IngestCheckpoint).filter(
+        models.IngestCheckpoint.upload_id == upload_id,
+        models.IngestCheckpoint.first_page == first_page,
+    )
+    checkpoint = query.first()
+    if checkpoint is None:
+        try:
+            checkpoint = models.IngestCheckpoint(upload_id=upload_id, first_page=first_page, last_page=last_page)
+            db.add(checkpoint)
+            db.commit()
+        except IntegrityError:
+            # Another delivery of the same task created it first
+            db.rollback()
+            checkpoint = query.one()
+    return checkpoint
+
+def advance_checkpoint(db, checkpoint, expected_units, units_done, chunks, completed=False) -> bool:
+    """Move the cursor forward and commit, unless another delivery of the task moved it first.
+
+    The update only applies while units_done still has the value this delivery
+    started from. Otherwise the uncommitted chunks are rolled back, because the
+    other delivery has already committed those units, and False is returned.
+    """
+    IngestCheckpoint = models.IngestCheckpoint
+    moved = db.execute(
+        update(IngestCheckpoint)
+        .where(IngestCheckpoint.id == checkpoint.id, IngestCheckpoint.units_done == expected_units, IngestCheckpoint.completed.is_(False))
+        .values(units_done=units_done, chunks_done=IngestCheckpoint.chunks_done + chunks, completed=completed)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not moved:
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+def ingest_units(db, upload, checkpoint, path, page_offset=0):
+    """Chunk, embed and insert a file (or the checkpoint's page range), resuming after its last committed unit.
+
+    Chunks are inserted one embedding batch at a time while later pages are still
+    being extracted, and committed together with the cursor at unit boundaries.
+    `page_offset` is the number of pages before `path` in the uploaded PDF, when
+    `path` holds only a slice of it. If another delivery of the same task commits
+    first, this one continues from that delivery's cursor instead.
+    """
+    while not checkpoint.completed:
+        if _ingest_from_cursor(db, upload, checkpoint, path, page_offset):
+            return
+        db.refresh(checkpoint)
+        print(f"Upload {upload.id} pages from {checkpoint.first_page}: another delivery committed first, resuming after unit {checkpoint.units_done}")
+
+def _ingest_from_cursor(db, upload, checkpoint, path, page_offset):
+    skip = checkpoint.units_done
+    # Already committed PDF pages and images are never re-extracted or re-OCR'd
+    extracted = iter_units(
+        path, upload.content_type, upload.filename,
+        checkpoint.first_page - page_offset, checkpoint.last_page and checkpoint.last_page - page_offset,
+        skip_units=skip,
+    )
+    units = extracted
+    if page_offset:
+        # Chunks cite the page number of the uploaded file, not of the slice
+        units = (unit._replace(page=unit.page + page_offset) for unit in extracted)
+
+    batch, uncommitted, committed_units, units_done = [], 0, skip, skip
+    try:
+        for index, unit in enumerate(units, start=skip):
+            units_done = index + 1
+            for chunk in split_unit(unit, upload.filename):
+                batch.append(chunk)
+                if len(batch) >= EMBEDDING_BATCH_SIZE:
+                    store_chunks(db, upload, batch)
+                    uncommitted += len(batch)
+                    batch = []
+            if uncommitted + len(batch) >= INGEST_COMMIT_CHUNKS:
+                store_chunks(db, upload, batch)
+                if not advance_checkpoint(db, checkpoint, committed_units, units_done, uncommitted + len(batch)):
+                    return False
+                batch, uncommitted, committed_units = [], 0, units_done
+        store_chunks(db, upload, batch)
+        return advance_checkpoint(db, checkpoint, committed_units, units_done, uncommitted + len(batch), completed=True)
+    finally:
+        # Stops extraction (its OCR threads, open workbooks) when this delivery gives way to another
+        getattr(extracted, "close", lambda: None)()
+
+def find_processed_copy(db, upload):
+    """Another completed upload of the same bytes, processed by the current pipeline version."""
+    if not upload.content_hash:
+        return None
+    return db.query(models.Upload).filter(
+        models.Upload.content_hash == upload.content_hash,
+        models.Upload.pipeline_version == PIPELINE_VERSION,
+        models.Upload.status == "completed",
+        models.Upload.id != upload.id,
+    ).order_by(models.Upload.id).first()
+
+def clone_chunks(db, upload, source):
+    """Copy the source upload's chunks and vectors to this upload with INSERT ... SELECT.
+
+    Nothing is downloaded, extracted or embedded. Within the same project and
+    organization the copies are near-duplicates by definition, so they are linked to
+    the source chunks instead of carrying vectors. In another scope the originals are
+    copied with their vectors and the near-duplicates stay linked to those copies. A
+    completed checkpoint is written in the same transaction, so a re-run of the task
+    cannot clone twice.
+    """
+    Chunk = models.ExtractedChunk
+    metadata = Chunk.metadata_json
+    if db.bind.dialect.name == "postgresql":
+        # Chunks cite the file name they came from; point the copies at this upload's name
+        metadata = cast(func.jsonb_set(cast(metadata, JSONB), "{filename}", func.to_jsonb(cast(literal(upload.filename), String))), JSON)
+    columns = ["content", "embedding", "metadata_json", "minhash", "duplicate_of_id", "upload_id", "project_id", "organization_id"]
+    target = (literal(upload.id), literal(upload.project_id), literal(upload.organization_id))
+    source_chunks = select().select_from(Chunk).where(Chunk.upload_id == source.id).order_by(Chunk.id)
+    same_scope = (source.project_id, source.organization_id) == (upload.project_id, upload.organization_id)
+    if same_scope:
+        copied = db.execute(insert(Chunk).from_select(columns, source_chunks.add_columns(
+            Chunk.content, cast(null(), Chunk.embedding.type), metadata, Chunk.minhash,
+            func.coalesce(Chunk.duplicate_of_id, Chunk.id), *target,
+        ))).rowcount
+    else:
+        copied = clone_across_scopes(db, upload, source_chunks, columns, metadata, target)
+    if not same_scope and near_duplicates.NEAR_DUP_ENABLED:
+        index_cloned_chunks(db, upload)
+    db.add(models.IngestCheckpoint(upload_id=upload.id, first_page=1, chunks_done=copied, completed=True))
+    upload.pipeline_version = PIPELINE_VERSION
+    upload.status = "completed"
+    db.commit()
+    return copied
+
+def clone_across_scopes(db, upload, source_chunks, columns, metadata, target):
+    """Copy chunks into another project or organization, keeping near-duplicates vector-free.
+
+    Chunks with a vector, or whose original lies outside the source upload, are
+    copied first with a vector. Each copy's duplicate_of_id temporarily holds the id of
+    the source chunk it was made from. The near-duplicates are then inserted pointing at
+    the copies of their originals, and the temporary links are cleared.
+    """
+    Chunk = models.ExtractedChunk
+    Original = aliased(Chunk)
+    Copy = aliased(Chunk)
+    copied = db.execute(insert(Chunk).from_select(columns, source_chunks.add_columns(
+        Chunk.content, func.coalesce(Chunk.embedding, Original.embedding), metadata, Chunk.minhash, Chunk.id, *target,
+    ).outerjoin(Original, Original.id == Chunk.duplicate_of_id).where(
+        or_(Chunk.duplicate_of_id.is_(None), Original.upload_id != Chunk.upload_id)
+    ))).rowcount
+    copied += db.execute(insert(Chunk).from_select(columns, source_chunks.add_columns(
+        Chunk.content, cast(null(), Chunk.embedding.type), metadata, Chunk.minhash, Copy.id, *target,
+    ).join(Copy, and_(Copy.upload_id == upload.id, Copy.duplicate_of_id == Chunk.duplicate_of_id)))).rowcount
+    db.execute(
+        update(Chunk).where(Chunk.upload_id == upload.id, Chunk.embedding.isnot(None))
+        .values(duplicate_of_id=None).execution_options(synchronize_session=False)
+    )
+    return copied
+
+def index_cloned_chunks(db, upload):
+    """Add cloned chunks to their project's near-duplicate index, signing any that predate signatures.
+
+    Only chunks with their own vector are indexed, as in store_chunks; near-duplicates are signed but not indexed.
+    """
+    Chunk = models.ExtractedChunk
+    rows = db.query(Chunk.id, Chunk.content, Chunk.minhash, Chunk.duplicate_of_id).filter(Chunk.upload_id == upload.id).all()
+    missing = [{"id": chunk_id, "minhash": near_duplicates.signature(content)} for chunk_id, content, minhash, _ in rows if minhash is None]
+    if missing:
+        db.execute(update(Chunk), missing)
+    signed = {m["id"]: m["minhash"] for m in missing}
+    originals = [(chunk_id, minhash or signed[chunk_id]) for chunk_id, _, minhash, duplicate_of in rows if duplicate_of is None]
+    near_duplicates.index_chunks(
+        db, upload.project_id, upload.organization_id,
+        [chunk_id for chunk_id, _ in originals], [minhash for _, minhash in originals],
+    )
+
+def update_local_index(db, upload):
+    """Append a finished upload's vectors to the NumPy index now rather than at the next search."""
+    if RETRIEVAL_BACKEND != "numpy" or upload.project_id is None:
+        return
+    from app import numpy_index
+
+    if not numpy_index.NUMPY_INDEX_SYNC_ON_INGEST:
+        return
+    try:
+        numpy_index.sync_project(db, upload.project_id)
+    except Exception as e:
+        print(f"⚠ Could not update the vector index of project {upload.project_id}: {e}")
+
+def page_ranges(page_count, size=FANOUT_RANGE_PAGES):
+    return [(start, min(start + size - 1, page_count)) for start in range(1, page_count + 1, size)]
+
+def plan_ranges(db, upload, path):
+    """Page ranges to fan a PDF out to, or None to process it in one task.
+
+    A re-run keeps the layout of its existing checkpoints, even if the fan-out settings changed since.
+    """
+    existing = db.query(models.IngestCheckpoint).filter(
+        models.IngestCheckpoint.upload_id == upload.id
+    ).order_by(models.IngestCheckpoint.first_page).all()
+    if existing:
+        ranges = [(c.first_page, c.last_page) for c in existing if c.last_page is not None]
+        return ranges or None
+    if os.path.splitext(upload.filename)[1].lower() != ".pdf":
+        return None
+    page_count = pdf_page_count(path)
+    return page_ranges(page_count) if page_count > FANOUT_PAGE_THRESHOLD else None
+
+def range_prefix(upload):
+    return f"{upload.s3_key}.pages/"
+
+def range_key(upload, first_page, last_page):
+    return f"{range_prefix(upload)}{first_page}-{last_page}.pdf"
+
+def delete_range_files(upload):
+    try:
+        # A re-run of process_document writes fresh files for the ranges it still needs
+        S3Service().delete_prefix(range_prefix(upload))
+    except Exception as e:
+        print(f"⚠ Could not delete the page range files of upload {upload.id}: {e}")
+
+def _upload_range_file(s3, part_path, key):
+    try:
+        if not s3.upload_file(part_path, key):
+            raise RuntimeError(f"Could not store {key}")
+    finally:
+        os.remove(part_path)
+
+def upload_range_files(db, upload, path, ranges):
+    """Store each unfinished page range as its own PDF, so range tasks download only their pages.
+
+    Slices are written one at a time (PyMuPDF documents are not thread-safe) while up to
+    FANOUT_UPLOAD_CONCURRENCY earlier slices upload in parallel, so the fan-out waits for
+    roughly one document's worth of transfer time spread over several connections.
+    """
+    done = {first for (first,) in db.query(models.IngestCheckpoint.first_page).filter(
+        models.IngestCheckpoint.upload_id == upload.id, models.IngestCheckpoint.completed.is_(True)
+    )}
+    s3 = S3Service()
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=FANOUT_UPLOAD_CONCURRENCY, thread_name_prefix="slice-upload") as pool:
+        for first, last in ranges:
+            if first in done:
+                continue
+            # Bounds the slices waiting on disk
+            while len(pending) >= FANOUT_UPLOAD_CONCURRENCY * 2:
+                pending.popleft().result()
+            handle, part_path = tempfile.mkstemp(suffix=".pdf", dir=os.path.dirname(path))
+            os.close(handle)
+            try:
+                write_pdf_pages(path, first, last, part_path)
+            except Exception:
+                os.remove(part_path)
+                raise
+            pending.append(pool.submit(_upload_range_file, s3, part_path, range_key(upload, first, last)))
+        for future in pending:
+            future.result()
+
+def retry_countdown(retries):
+    return get_exponential_backoff_interval(INGEST_RETRY_BACKOFF, retries, INGEST_RETRY_BACKOFF_MAX, full_jitter=True)
+
+@celery_app.task(name="process_document", bind=True, max_retries=INGEST_MAX_RETRIES)
+def process_document(self, upload_id: int):
     SessionLocal = get_session_local()
     db = SessionLocal()
+    upload = None
     try:
         upload = db.query(models.Upload).filter(models.Upload.id == upload_id).first()
         if not upload:
             return "Upload not found"
         
+        # A file already processed elsewhere is cloned instead of downloaded, OCR'd and embedded again
+        started = db.query(models.IngestCheckpoint.id).filter(models.IngestCheckpoint.upload_id == upload_id).first()
+        source = None if started else find_processed_copy(db, upload)
+        if source:
+            copied = clone_chunks(db, upload, source)
+            update_local_index(db, upload)
+            print(f"Upload {upload_id} matches upload {source.id}, cloned {copied} chunks")
+            return {"status": "completed", "upload_id": upload_id, "cloned_from": source.id}
+
         upload.status = "processing"
         db.commit()
         
+        # Spool the object to a temp file so only one download chunk is in memory,
+        # and extract from the path so parsers can read pages lazily from disk
         s3 = S3Service()
-        # Download file from S3
-        # Since we're in a shared filesystem in some cases, or need to download to memory
-        # For simplicity, download to memory
-        bucket_name = os.getenv("MINIO_BUCKET_NAME")
-        response = s3.s3_client.get_object(Bucket=bucket_name, Key=upload.s3_key)
-        file_bytes = response['Body'].read()
-        
-        # Extract content
-        text_content = extract_content(file_bytes, upload.content_type, upload.filename)
-        
-        # Chunking
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        chunks = text_splitter.split_text(text_content)
-        
-        # Embed and Store
-        for i, chunk_text in enumerate(chunks):
-            embedding = get_embedding(chunk_text)
-            db_chunk = models.ExtractedChunk(
-                content=chunk_text,
-                embedding=embedding,
-                metadata_json={"page": i+1, "filename": upload.filename},
-                upload_id=upload.id
-            )
-            db.add(db_chunk)
+        suffix = os.path.splitext(upload.filename)[1].lower()
+        with s3.download_to_tempfile(upload.s3_key, suffix=suffix) as path:
+            ranges = plan_ranges(db, upload, path)
+            if ranges:
+                # Large PDFs are spread over the workers as page ranges; the chord
+                # callback marks the upload completed once every range is stored
+                upload_range_files(db, upload, path, ranges)
+                chord(
+                    process_document_range.s(upload_id, first, last, range_key(upload, first, last))
+                    for first, last in ranges
+                )(finalize_document.s(upload_id).on_error(fail_document.s(upload_id)))
+                print(f"Split upload {upload_id} into {len(ranges)} page range tasks")
+                return {"status": "processing", "upload_id": upload_id, "ranges": len(ranges)}
+
+            ingest_units(db, upload, get_checkpoint(db, upload_id), path)
         
+        upload.pipeline_version = PIPELINE_VERSION
         upload.status = "completed"
         db.commit()
+        update_local_index(db, upload)
         print(f"Finished processing for upload {upload_id}")
         return {"status": "completed", "upload_id": upload_id}
         
+    except TRANSIENT_ERRORS as e:
+        db.rollback()
+        if self.request.retries < self.max_retries:
+            countdown = retry_countdown(self.request.retries)
+            print(f"Transient error processing upload {upload_id}, retrying in {countdown}s: {e}")
+            raise self.retry(exc=e, countdown=countdown)
+        print(f"Error processing document: {e}")
+        if upload:
+            upload.status = "failed"
+            db.commit()
+        return {"status": "failed", "error": str(e)}
     except Exception as e:
         print(f"Error processing document: {e}")
+        db.rollback()
         if upload:
             upload.status = "failed"
             db.commit()
         return {"status": "failed", "error": str(e)}
     finally:
         db.close()
+
+@celery_app.task(name="process_document_range", bind=True, max_retries=INGEST_MAX_RETRIES)
+def process_document_range(self, upload_id: int, first_page: int, last_page: int, s3_key: str = None):
+    """Extract, OCR and embed one page range of a large PDF. Errors are returned, not raised,
+    so the chord callback always runs and can mark the upload.
+
+    `s3_key` names a PDF holding only this range's pages; without it the whole upload is downloaded.
+    """
+    SessionLocal = get_session_local()
+    db = SessionLocal()
+    try:
+        upload = db.query(models.Upload).filter(models.Upload.id == upload_id).first()
+        if not upload:
+            return {"status": "failed", "error": "Upload not found"}
+        checkpoint = get_checkpoint(db, upload_id, first_page, last_page)
+        if not checkpoint.completed:
+            with S3Service().download_to_tempfile(s3_key or upload.s3_key, suffix=".pdf") as path:
+                ingest_units(db, upload, checkpoint, path, page_offset=first_page - 1 if s3_key else 0)
+        print(f"Finished pages {first_page}-{last_page} of upload {upload_id}")
+        return {"status": "completed", "pages": [first_page, last_page]}
+    except TRANSIENT_ERRORS as e:
+        db.rollback()
+        if self.request.retries < self.max_retries:
+            countdown = retry_countdown(self.request.retries)
+            print(f"Transient error on pages {first_page}-{last_page} of upload {upload_id}, retrying in {countdown}s: {e}")
+            raise self.retry(exc=e, countdown=countdown)
+        return {"status": "failed", "pages": [first_page, last_page], "error": str(e)}
+    except Exception as e:
+        print(f"Error processing pages {first_page}-{last_page} of upload {upload_id}: {e}")
+        db.rollback()
+        return {"status": "failed", "pages": [first_page, last_page], "error": str(e)}
+    finally:
+        db.close()
+
+@celery_app.task(name="finalize_document")
+def finalize_document(range_results, upload_id: int):
+    """Chord callback: mark the upload completed, or failed if any range failed.
+
+    Chunks of the ranges that did finish are kept, so re-running process_document
+    only redoes the missing pages.
+    """
+    SessionLocal = get_session_local()
+    db = SessionLocal()
+    try:
+        upload = db.query(models.Upload).filter(models.Upload.id == upload_id).first()
+        if not upload:
+            return "Upload not found"
+        failed = [r for r in range_results if r.get("status") != "completed"]
+        delete_range_files(upload)
+        if failed:
+            upload.status = "failed"
+            print(f"Upload {upload_id} failed in {len(failed)} of {len(range_results)} page ranges: {failed[0].get('error')}")
+        else:
+            upload.pipeline_version = PIPELINE_VERSION
+            upload.status = "completed"
+            print(f"Finished processing for upload {upload_id}")
+        db.commit()
+        if upload.status == "completed":
+            update_local_index(db, upload)
+        return {"status": upload.status, "upload_id": upload_id}
+    finally:
+        db.close()
+
+@celery_app.task(name="fail_document")
+def fail_document(request, exc, traceback, upload_id: int):
+    """Chord errback: a range task raised instead of returning, or finalize_document itself
+    failed, so the callback never recorded a final status. Marks the upload failed."""
+    SessionLocal = get_session_local()
+    db = SessionLocal()
+    try:
+        upload = db.query(models.Upload).filter(models.Upload.id == upload_id).first()
+        if not upload or upload.status != "processing":
+            return "Upload not found or already finished"
+        upload.status = "failed"
+        db.commit()
+        print(f"Upload {upload_id} failed in its page range chord: {exc}")
+        delete_range_files(upload)
+        return {"status": "failed", "upload_id": upload_id}
+    finally:
+        db.close()
+
+@celery_app.task(name="run_analysis_job")
+def run_analysis_job(job_id: int):
+    SessionLocal = get_session_local()
+    db = SessionLocal()
+    job = None
+    try:
+        job = db.query(models.AnalysisJob).filter(models.AnalysisJob.id == job_id).first()
+        if not job or not transition_job(db, job, ACTIVE_STATUSES, status="running", stage="Starting", progress=1):
+            return "Job not found or already finished"
+
+        report = lambda stage, percent: update_job(db, job, stage=stage, progress=percent)
+        result = generate_analysis(job.project_id, db, job.constraints, on_progress=report)
+        if result is None:
+            transition_job(db, job, ("running",), status="failed", error="Project not found")
+            return {"status": "failed", "job_id": job_id}
+
+        # The result is stored either way; if the job was expired meanwhile, the next request reuses it from the cache
+        if not transition_job(db, job, ("running",), status="completed", stage="Done", progress=100, result_id=result.id):
+            print(f"Analysis job {job_id} ended while running ({job.status}), result {result.id} kept for reuse")
+            return {"status": job.status, "job_id": job_id, "result_id": result.id}
+        print(f"Finished analysis job {job_id}, result {result.id}")
+        return {"status": "completed", "job_id": job_id, "result_id": result.id}
+
+    except Exception as e:
+        print(f"Error running analysis job {job_id}: {e}")
+        db.rollback()
+        if job:
+            transition_job(db, job, ("running",), status="failed", error=str(e))
+        return {"status": "failed", "error": str(e)}
+    finally:
+        db.close()
@@ -1,8 +1,8 @@
 "use client";
 
 import { useEffect, useState } from "react";
-import { useParams } from "next/navigation";
-import api from "@/lib/api";
+import { useParams, useSearchParams } from "next/navigation";
+import api, { waitForAnalysisJob } from "@/lib/api";
 import { ComparisonTable } from "@/components/ComparisonTable";
 import { Recommendations } from "@/components/Recommendations";
 import { ChatPanel } from "@/components/ChatPanel";
@@ -23,6 +23,7 @@ import { cn } from "@/lib/utils";
 
 export default function ProjectPage() {
     const { id } = useParams();
+    const searchParams = useSearchParams();
     const [project, setProject] = useState<any>(null);
     const [results, setResults] = useState<any>(null);
     const [loading, setLoading] = useState(true);
@@ -46,16 +47,25 @@ export default function ProjectPage() {
     };
 
     useEffect(() => {
-        fetchAll();
+        // Coming from the wizard, wait for the analysis job it started before loading results
+        const jobId = searchParams.get("job");
+        if (jobId) {
+            waitForAnalysisJob(id as string, Number(jobId))
+                .catch(err => console.error("Analysis job failed:", err))
+                .finally(fetchAll);
+        } else {
+            fetchAll();
+        }
     }, [id]);
 
     const handleRefine = async () => {
         setRefining(true);
         try {
-            await api.post(`/projects/${id}/run-analysis`, {
+            const res = await api.post(`/projects/${id}/run-analysis`, {
                 budget: "Low",
                 compliance: "GDPR"
             });
+            await waitForAnalysisJob(id as string, res.data.id);
             fetchAll();
         } catch (err) {
             alert("Refinement failed");
@@ -3,18 +3,30 @@
 import { useState, useRef, useEffect } from "react";
 import { Send, Bot, User, Loader2 } from "lucide-react";
 import { cn } from "@/lib/utils";
-import api from "@/lib/api";
+import { apiUrl } from "@/lib/api";
 
 export function ChatPanel({ projectId }: { projectId: string }) {
     const [messages, setMessages] = useState<any[]>([]);
     const [input, setInput] = useState("");
     const [loading, setLoading] = useState(false);
+    const [streaming, setStreaming] = useState(false);
     const scrollRef = useRef<HTMLDivElement>(null);
+    const abortRef = useRef<AbortController | null>(null);
 
     useEffect(() => {
         scrollRef.current?.scrollIntoView({ behavior: "smooth" });
     }, [messages]);
 
+    // Closing the panel mid-answer drops the connection so the backend stops generating
+    useEffect(() => () => abortRef.current?.abort(), []);
+
+    const appendToAnswer = (text: string) => {
+        setMessages(prev => {
+            const last = prev[prev.length - 1];
+            return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+        });
+    };
+
     const onSend = async () => {
         if (!input || loading) return;
         const userMsg = { role: "user", content: input };
@@ -22,14 +34,52 @@ export function ChatPanel({ projectId }: { projectId: string }) {
         setInput("");
         setLoading(true);
 
+        const controller = new AbortController();
+        abortRef.current = controller;
+        let started = false;
+
         try {
-            const res = await api.post(`/projects/${projectId}/chat?message=${encodeURIComponent(input)}`);
-            setMessages(prev => [...prev, { role: "assistant", content: res.data.answer }]);
+            const token = localStorage.getItem("token");
+            const res = await fetch(`${apiUrl}/projects/${projectId}/chat/stream?message=${encodeURIComponent(input)}`, {
+                method: "POST",
+                headers: token ? { Authorization: `Bearer ${token}` } : {},
+                signal: controller.signal,
+            });
+            if (!res.ok || !res.body) throw new Error(`Chat request failed: ${res.status}`);
+
+            // Parse server-sent events: blank-line separated, one JSON "data:" line each
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split("\n\n");
+                buffer = events.pop() ?? "";
+                for (const event of events) {
+                    const dataLine = event.split("\n").find(line => line.startsWith("data: "));
+                    if (!dataLine) continue;
+                    const data = JSON.parse(dataLine.slice(6));
+                    const text = data.token ?? (data.error ? `\n\n${data.error}` : "");
+                    if (!text) continue;
+                    if (!started) {
+                        started = true;
+                        setStreaming(true);
+                        setMessages(prev => [...prev, { role: "assistant", content: "" }]);
+                    }
+                    appendToAnswer(text);
+                }
+            }
         } catch (err) {
+            if (controller.signal.aborted) return;
             console.error(err);
-            setMessages(prev => [...prev, { role: "assistant", content: "Sorry, I encountered an error. Please try again." }]);
+            if (!started) {
+                setMessages(prev => [...prev, { role: "assistant", content: "Sorry, I encountered an error. Please try again." }]);
+            }
         } finally {
             setLoading(false);
+            setStreaming(false);
         }
     };
 
@@ -60,7 +110,7 @@ export function ChatPanel({ projectId }: { projectId: string }) {
                         </div>
                     </div>
                 ))}
-                {loading && (
+                {loading && !streaming && (
                     <div className="flex gap-3 items-center text-muted-foreground animate-pulse">
                         <Loader2 className="w-4 h-4 animate-spin" />
                         <span className="text-xs">Thinking...</span>
@@ -86,10 +86,10 @@ export function ProjectWizard() {
                 }
             }
 
-            // Start Analysis
-            await api.post(`/projects/${project.id}/run-analysis`);
+            // Start Analysis (runs in the background; the project page polls the job)
+            const job = await api.post(`/projects/${project.id}/run-analysis`);
 
-            router.push(`/projects/${project.id}`);
+            router.push(`/projects/${project.id}?job=${job.data.id}`);
         } catch (error) {
             console.error("Failed to create project:", error);
             alert("Error creating project. Check console.");
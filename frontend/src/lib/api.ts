@@ -1,7 +1,7 @@
 import axios from "axios";
 
 // Use the public backend URL if available, otherwise fallback to /api proxy
-const apiUrl = process.env.NEXT_PUBLIC_BACKEND_URL || "/api";
+export const apiUrl = process.env.NEXT_PUBLIC_BACKEND_URL || "/api";
 
 const api = axios.create({
     baseURL: apiUrl,
@@ -39,3 +39,24 @@ api.interceptors.response.use(
 );
 
 export default api;
+
+// Slightly longer than the backend's ANALYSIS_JOB_TIMEOUT_SECONDS for stalled running jobs. Queued jobs
+// may wait longer behind document ingestion; they keep going, and asking again joins the same job
+const ANALYSIS_JOB_MAX_WAIT_MS = 35 * 60 * 1000;
+
+// Analysis runs as a background job; poll until it finishes and return the final job
+export async function waitForAnalysisJob(
+    projectId: string | number,
+    jobId: number,
+    intervalMs = 2000,
+    maxWaitMs = ANALYSIS_JOB_MAX_WAIT_MS,
+) {
+    const deadline = Date.now() + maxWaitMs;
+    while (Date.now() < deadline) {
+        const res = await api.get(`/projects/${projectId}/analysis-jobs/${jobId}`);
+        if (res.data.status === "completed") return res.data;
+        if (res.data.status === "failed") throw new Error(res.data.error || "Analysis failed");
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+    throw new Error("Analysis is still queued or running; please check again later");
+}